@@ -0,0 +1,222 @@
+"""
+Archiving the comments on objects nobody comments on any more.
+
+All comments on an archived object are moved from the ``comments`` table to
+``comments_archive``, which has the same fields, so the table comments are
+posted to and its indexes only hold the objects still discussed. Reads go
+through ``get_comment_model_for``, which picks the archive for archived
+objects; whether an object is archived is cached for
+``COMMENTS_ARCHIVE_CACHE_TIMEOUT`` seconds. Archived comments are read-only;
+saving a new comment on an archived object restores its comments first, and
+replies to archived comments are turned down.
+
+Flags, fingerprints and queued notifications of archived comments aren't
+kept; the flag counters on the comments are.
+
+With ``COMMENTS_ARCHIVE_COMPRESSION`` set to ``'zlib'`` or ``'lzma'``, the
+title and text of archived comments are stored compressed (see
+``comments.compression``) and decompressed as they're loaded.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router, transaction
+from django.db.models import Max
+from django.utils.encoding import force_bytes, force_text
+
+from comments import signals
+from comments.bulk import _reset_sequences
+from comments.compression import CODECS, compress_text, split_header
+
+COMMENTS_ARCHIVE_COMPRESSION = getattr(settings, 'COMMENTS_ARCHIVE_COMPRESSION', None)
+COMMENTS_ARCHIVE_CACHE = getattr(settings, 'COMMENTS_ARCHIVE_CACHE', 'default')
+COMMENTS_ARCHIVE_CACHE_TIMEOUT = getattr(settings, 'COMMENTS_ARCHIVE_CACHE_TIMEOUT', 3600)
+
+# The fields stored compressed in the archive.
+COMPRESSED_FIELDS = ('title', 'comment')
+
+# Django 1.6 nests atomic blocks; Django 1.5 only has commit_on_success.
+atomic = getattr(transaction, 'atomic', transaction.commit_on_success)
+
+
+def _get_models():
+    from comments.models import ArchivedComment, ArchivedObject, Comment
+    return Comment, ArchivedComment, ArchivedObject
+
+
+def _delete_moved(qs):
+    """
+    Delete the comments of ``qs`` moved to or from the archive, without
+    dropping the cached feeds once per comment; ``_send_changed`` follows.
+    """
+    from comments import models
+    models._moving_comments.active = True
+    try:
+        qs.delete()
+    finally:
+        models._moving_comments.active = False
+
+
+def _send_changed(model, instances, using):
+    tree_ids = sorted(set(obj.tree_id for obj in instances))
+    if tree_ids:
+        signals.comment_threads_were_changed.send(sender=model, tree_ids=tree_ids, using=using)
+
+
+def _copy(instances, model):
+    """
+    Return unsaved ``model`` instances with the field values of ``instances``.
+    """
+    fields = [f.attname for f in model._meta.fields]
+    return [model(**dict((f, getattr(obj, f)) for f in fields)) for obj in instances]
+
+
+def get_compression():
+    """
+    Return the codec named by ``COMMENTS_ARCHIVE_COMPRESSION``, or ``None``.
+    """
+    codec = COMMENTS_ARCHIVE_COMPRESSION
+    if codec is not None and codec not in CODECS:
+        raise ImproperlyConfigured("The COMMENTS_ARCHIVE_COMPRESSION setting must be one "
+                                   "of %s, or None." % ', '.join(sorted(CODECS)))
+    return codec
+
+
+def _archived_key(ctype, object_pk):
+    ctype_id = getattr(ctype, 'pk', ctype)
+    return 'comments.archived.%s' % hashlib.md5(force_bytes('%s:%s' % (
+        ctype_id, force_text(object_pk)))).hexdigest()
+
+
+def is_archived(ctype, object_pk):
+    """
+    Return whether the comments on an object were archived. The answer is
+    cached; ``archive_object`` and ``restore_object`` drop it.
+    """
+    Comment, ArchivedComment, ArchivedObject = _get_models()
+    cache = get_cache(COMMENTS_ARCHIVE_CACHE)
+    key = _archived_key(ctype, object_pk)
+    archived = cache.get(key)
+    if archived is None:
+        archived = ArchivedObject.objects.filter(content_type=ctype,
+                                                 object_pk=force_text(object_pk)).exists()
+        cache.set(key, archived, COMMENTS_ARCHIVE_CACHE_TIMEOUT)
+    return archived
+
+
+def get_comment_model_for(ctype, object_pk):
+    """
+    Return the model holding the comments on an object: the comment model,
+    or ``ArchivedComment`` if the object's comments were archived.
+    """
+    import comments
+    Comment, ArchivedComment, ArchivedObject = _get_models()
+    model = comments.get_model()
+    if model is Comment and is_archived(ctype, object_pk):
+        return ArchivedComment
+    return model
+
+
+def archivable_objects(before, limit=None):
+    """
+    Return ``(content_type_id, object_pk)`` tuples of the objects whose
+    latest comment was submitted before ``before``.
+    """
+    Comment, ArchivedComment, ArchivedObject = _get_models()
+    qs = Comment.objects.order_by().values_list('content_type', 'object_pk').annotate(
+        last_date=Max('submit_date')).filter(last_date__lt=before)
+    if limit is not None:
+        qs = qs[:limit]
+    return [(ctype_id, object_pk) for ctype_id, object_pk, last_date in qs]
+
+
+def archive_object(ctype, object_pk, using=None):
+    """
+    Move the comments on an object to the archive. Returns the number of
+    archived comments.
+    """
+    Comment, ArchivedComment, ArchivedObject = _get_models()
+    using = using or router.db_for_write(Comment)
+    object_pk = force_text(object_pk)
+    codec = get_compression()
+    qs = Comment.objects.using(using).filter(content_type=ctype, object_pk=object_pk)
+    with atomic(using=using):
+        # Hold off replies to the object's threads while they move.
+        list(qs.select_for_update().filter(parent__isnull=True).values_list('pk', flat=True))
+        instances = list(qs)
+        archived = _copy(instances, ArchivedComment)
+        for obj in archived:
+            for f in COMPRESSED_FIELDS:
+                setattr(obj, f, compress_text(getattr(obj, f), codec))
+        ArchivedComment.objects.using(using).bulk_create(archived)
+        _delete_moved(qs)
+        ArchivedObject.objects.using(using).get_or_create(content_type=ctype, object_pk=object_pk)
+    get_cache(COMMENTS_ARCHIVE_CACHE).delete(_archived_key(ctype, object_pk))
+    _send_changed(Comment, instances, using)
+    return len(instances)
+
+
+def restore_object(ctype, object_pk, using=None):
+    """
+    Move the comments on an object back from the archive. They keep their
+    primary keys unless other comments took them since they were archived.
+    Returns the number of restored comments.
+    """
+    Comment, ArchivedComment, ArchivedObject = _get_models()
+    using = using or router.db_for_write(Comment)
+    object_pk = force_text(object_pk)
+    archived = ArchivedComment.objects.using(using).filter(content_type=ctype, object_pk=object_pk)
+    # Comment.save() restores objects, possibly in a transaction of its own.
+    with atomic(using=using):
+        instances = _copy(archived.order_by('tree_id', 'lft'), Comment)
+        manager = Comment.objects.using(using)
+        renumber = manager.filter(pk__in=[c.pk for c in instances]).exists()
+        if renumber:
+            # Parents come before their replies in tree order.
+            next_pk = (manager.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+            new_pks = {}
+            for instance in instances:
+                new_pks[instance.pk] = next_pk
+                instance.pk = next_pk
+                instance.parent_id = new_pks.get(instance.parent_id)
+                next_pk += 1
+        manager.bulk_create(instances)
+        if renumber:
+            _reset_sequences(using, [Comment])
+        _delete_moved(archived)
+        ArchivedObject.objects.using(using).filter(content_type=ctype, object_pk=object_pk).delete()
+    get_cache(COMMENTS_ARCHIVE_CACHE).delete(_archived_key(ctype, object_pk))
+    _send_changed(Comment, instances, using)
+    return len(instances)
+
+
+def compress_archive(codec=None, batch_size=1000, using=None):
+    """
+    Compress the text of the archived comments stored uncompressed, such as
+    those archived before compression was turned on. Returns the number of
+    comments compressed.
+    """
+    Comment, ArchivedComment, ArchivedObject = _get_models()
+    codec = codec or get_compression()
+    using = using or router.db_for_write(ArchivedComment)
+    # Loaded as plain values, so nothing is decompressed on the way.
+    qs = ArchivedComment.objects.using(using).order_by('pk').values_list('pk', *COMPRESSED_FIELDS)
+    compressed = 0
+    last_pk = 0
+    while True:
+        batch = list(qs.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        with atomic(using=using):
+            for row in batch:
+                # Values with a header are already stored compressed or escaped.
+                values = dict((f, value if split_header(value) else compress_text(value, codec))
+                              for f, value in zip(COMPRESSED_FIELDS, row[1:]))
+                if values != dict(zip(COMPRESSED_FIELDS, row[1:])):
+                    ArchivedComment.objects.using(using).filter(pk=row[0]).update(**values)
+                    compressed += 1
+    return compressed
@@ -0,0 +1,404 @@
+"""
+Bulk operations on comments which bypass ``Comment.save()``.
+
+``import_comments`` writes comments from another system with ``bulk_create``,
+computing their tree fields in memory rather than having mptt insert them
+one at a time. Nothing is moderated and no signals are sent.
+
+``comment_records`` and ``flag_records`` read comments and flags in keyset
+chunks as plain dicts, in the format ``import_comments`` takes.
+
+``fill_object_pk_ints`` sets the integer object keys of existing comments,
+``anonymize_comments`` and ``erase_user_comments`` blank the personal data
+of comments in chunked updates, and ``expire_personal_data`` the IP and email
+addresses of old comments.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connections, router
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from comments import signals
+from comments.compression import decompress_text
+from comments.managers import integer_pk
+from comments.posting import atomic
+from comments.trees import number_thread
+
+IMPORT_CHUNK_SIZE = 1000
+
+# The record keys copied to comment fields as they are.
+IMPORT_FIELDS = ('object_pk', 'user_name', 'user_email', 'user_url', 'title',
+                 'comment', 'ip_address', 'is_public', 'is_removed')
+
+# The fields expire_personal_data can blank.
+EXPIRED_FIELDS = ('ip_address', 'user_email', 'user_url')
+# The ones it blanks unless told otherwise.
+DEFAULT_EXPIRED_FIELDS = ('ip_address', 'user_email')
+
+EXPORT_CHUNK_SIZE = 1000
+
+# The comment fields exported besides those imported.
+EXPORT_FIELDS = IMPORT_FIELDS + ('id', 'parent_id', 'content_type_id', 'site_id',
+                                 'user_id', 'submit_date', 'tree_id', 'lft', 'flag_count',
+                                 'suggest_removal_count', 'moderator_deletion_count',
+                                 'moderator_approval_count', 'spam_score')
+
+
+def _get_submit_date(value):
+    if not hasattr(value, 'year'):
+        value = parse_datetime(value)
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return value
+
+
+def _reset_sequences(using, models):
+    connection = connections[using]
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), models):
+        cursor.execute(sql)
+
+
+class CommentImporter(object):
+    """
+    Builds comment threads from records and writes them in chunks.
+
+    Primary keys and tree ids are handed out in memory, above the largest
+    ones in use when the import starts, and ``close()`` moves the database
+    sequences past them; it has to be called however the import ends, as
+    the chunks written before a failure stay committed. Comments posted
+    while an import runs could take the same keys, so imports are meant to
+    run while posting is disabled.
+    """
+
+    def __init__(self, model=None, chunk_size=IMPORT_CHUNK_SIZE, using=None):
+        from comments.models import CommentTreeId
+        if model is None:
+            import comments
+            model = comments.get_model()
+        self.model = model
+        self.chunk_size = chunk_size
+        self.using = using or router.db_for_write(model)
+        self.opts = model._mptt_meta
+        self.integer_pks = 'object_pk_int' in [f.name for f in model._meta.fields]
+        manager = model._default_manager.using(self.using)
+        self.next_pk = (manager.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+        self.first_tree_id = self.next_tree_id = CommentTreeId.allocate(self.using)
+        self.pending = []
+        self.count = 0
+
+    def build_thread(self, records):
+        """
+        Create the comments of one thread, the first record being its root,
+        and set up their tree fields in the order mptt would have put them:
+        replies by date, then in the order they were given (their primary
+        keys follow that order).
+        """
+        instances = []
+        by_id = {}
+        replies = {}
+        for record in records:
+            parent = record.get('parent')
+            if parent is not None and parent not in by_id:
+                raise ValueError("Comment %r replies to %r, which isn't in its thread; "
+                                 "the replies of a thread have to follow its root and "
+                                 "their parents." % (record.get('id'), parent))
+            instance = self.model(
+                pk = self.next_pk,
+                content_type = ContentType.objects.get_by_natural_key(*record['content_type'].split('.', 1)),
+                site_id = record.get('site', settings.SITE_ID),
+                user_id = record.get('user'),
+                submit_date = _get_submit_date(record['submit_date']),
+                parent_id = parent is not None and by_id[parent].pk or None,
+                **dict((f, record[f]) for f in IMPORT_FIELDS if f in record)
+            )
+            if self.integer_pks:
+                instance.object_pk_int = integer_pk(instance.object_pk)
+            self.next_pk += 1
+            instances.append(instance)
+            if record.get('id') is not None:
+                by_id[record['id']] = instance
+            replies[instance.pk] = []
+            if parent is not None:
+                replies[instance.parent_id].append(instance)
+
+        number_thread(instances[0], replies, self.opts, self.next_tree_id)
+        self.next_tree_id += 1
+        return instances
+
+    def add_thread(self, records):
+        self.pending.extend(self.build_thread(records))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with atomic(using=self.using):
+                self.model._default_manager.using(self.using).bulk_create(self.pending)
+            self.count += len(self.pending)
+            self.pending = []
+
+    def finish(self):
+        self.flush()
+        return self.count
+
+    def close(self):
+        """
+        Reserve the tree ids handed out and move the primary key sequences
+        past the comments written.
+        """
+        from comments.models import CommentTreeId
+        if self.next_tree_id - 1 > self.first_tree_id:
+            CommentTreeId.objects.using(self.using).create(pk=self.next_tree_id - 1)
+        _reset_sequences(self.using, [self.model, CommentTreeId])
+
+
+def import_comments(records, model=None, chunk_size=IMPORT_CHUNK_SIZE, using=None):
+    """
+    Import comments from an iterable of dicts and return how many were
+    imported.
+
+    Each record has the ``content_type`` (as ``"app_label.model"``),
+    ``object_pk``, ``comment`` and ``submit_date`` (a datetime or an ISO 8601
+    string) of a comment, and optionally its ``site`` and ``user`` ids and
+    the other comment fields. Threads are given by the ``id`` of each record
+    and the ``parent`` id of replies; the records of a thread must come
+    together, its root first and every reply after its parent, as they do in
+    tree order. Records are consumed as a stream, holding one thread and one
+    chunk of ``chunk_size`` comments in memory at a time.
+    """
+    importer = CommentImporter(model, chunk_size, using)
+    try:
+        thread = []
+        for record in records:
+            if record.get('parent') is None and thread:
+                importer.add_thread(thread)
+                thread = []
+            thread.append(record)
+        if thread:
+            importer.add_thread(thread)
+        return importer.finish()
+    finally:
+        importer.close()
+
+
+def fill_object_pk_ints(model=None, chunk_size=IMPORT_CHUNK_SIZE, using=None):
+    """
+    Set ``object_pk_int`` on the comments saved without it, such as those
+    saved before the column was added, and return how many were updated.
+    Comments are read in primary key order, ``chunk_size`` at a time, and
+    updated with one query per object.
+    """
+    if model is None:
+        import comments
+        model = comments.get_model()
+    using = using or router.db_for_write(model)
+    manager = model._default_manager.using(using)
+    qs = manager.filter(object_pk_int__isnull=True).order_by('pk').values_list('pk', 'object_pk')
+    updated = 0
+    last_pk = 0
+    while True:
+        chunk = list(qs.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        by_object = {}
+        for pk, object_pk in chunk:
+            value = integer_pk(object_pk)
+            if value is not None:
+                by_object.setdefault(value, []).append(pk)
+        with atomic(using=using):
+            for value, pks in by_object.items():
+                updated += manager.filter(pk__in=pks).update(object_pk_int=value)
+    return updated
+
+
+def recount_flag_counters(chunk_size=IMPORT_CHUNK_SIZE, using=None):
+    """
+    Set the flag counters of the comments from their flags, such as on the
+    comments flagged before the counters were kept, and return how many
+    comments were updated. Comments are read in primary key order,
+    ``chunk_size`` at a time, each chunk locked in a transaction of its own
+    while its flags are counted.
+    """
+    from comments.models import Comment, CommentFlag, FLAG_COUNTER_FIELDS
+    using = using or router.db_for_write(Comment)
+    manager = Comment._default_manager.using(using)
+    qs = manager.order_by('pk').values_list('pk', *FLAG_COUNTER_FIELDS)
+    flags = CommentFlag._default_manager.using(using).order_by()
+    updated = 0
+    last_pk = 0
+    while True:
+        with atomic(using=using):
+            chunk = list(qs.select_for_update().filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            counts = dict((row[0], dict.fromkeys(FLAG_COUNTER_FIELDS, 0)) for row in chunk)
+            grouped = flags.filter(comment__in=list(counts)).values_list('comment', 'flag')
+            for pk, flag, count in grouped.annotate(Count('pk')):
+                counts[pk]['flag_count'] += count
+                if flag in CommentFlag.COUNTER_FIELDS:
+                    counts[pk][CommentFlag.COUNTER_FIELDS[flag]] += count
+            for row in chunk:
+                values = counts[row[0]]
+                if tuple(values[f] for f in FLAG_COUNTER_FIELDS) != tuple(row[1:]):
+                    manager.filter(pk=row[0]).update(**values)
+                    updated += 1
+    return updated
+
+
+def anonymize_comments(queryset, remove=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Blank the poster's user, name, email, URL and IP address on the comments
+    of ``queryset``, also marking them removed if ``remove`` is true, and
+    return how many were updated.
+
+    Comments are updated ``chunk_size`` at a time with one ``UPDATE`` per
+    chunk, each in its own transaction, without changing the trees they are
+    in. ``comment_threads_were_changed`` is sent once for all the threads
+    with updated comments.
+    """
+    values = dict(user=None, user_name='', user_email='', user_url='', ip_address=None)
+    if remove:
+        values['is_removed'] = True
+    model, using = queryset.model, queryset.db
+    qs = queryset.order_by('pk').values_list('pk', 'tree_id')
+    updated = 0
+    tree_ids = set()
+    last_pk = 0
+    while True:
+        chunk = list(qs.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        with atomic(using=using):
+            updated += model._default_manager.using(using).filter(
+                pk__in=[pk for pk, tree_id in chunk]).update(**values)
+        tree_ids.update(tree_id for pk, tree_id in chunk)
+    if tree_ids:
+        signals.comment_threads_were_changed.send(sender=model, tree_ids=sorted(tree_ids),
+                                                  using=using)
+    return updated
+
+
+def erase_user_comments(user, remove=False, chunk_size=IMPORT_CHUNK_SIZE, using=None):
+    """
+    Anonymize the comments and archived comments of ``user`` (a user or its
+    primary key) with ``anonymize_comments`` and return how many were
+    updated.
+    """
+    import comments
+    from comments.models import ArchivedComment, Comment
+    models = [comments.get_model()]
+    if models[0] is Comment:
+        models.append(ArchivedComment)
+    updated = 0
+    for model in models:
+        qs = model._default_manager.using(using or router.db_for_write(model)).filter(user=user)
+        updated += anonymize_comments(qs, remove, chunk_size)
+    return updated
+
+
+def expire_personal_data(before, fields=DEFAULT_EXPIRED_FIELDS, model=None,
+                         chunk_size=IMPORT_CHUNK_SIZE, pause=0, using=None):
+    """
+    Blank ``fields`` (some of ``EXPIRED_FIELDS``) on the comments submitted
+    before ``before`` and return how many were updated.
+
+    Comments are read in ``(submit_date, pk)`` order from the index on
+    ``submit_date`` and updated ``chunk_size`` at a time, each chunk in a
+    transaction of its own followed by a ``pause`` of that many seconds, so
+    it can run on a live table.
+    """
+    if model is None:
+        import comments
+        model = comments.get_model()
+    using = using or router.db_for_write(model)
+    values = {}
+    blank = Q()
+    for f in fields:
+        if f not in EXPIRED_FIELDS:
+            raise ValueError("Can't expire the %r field; use some of %s." % (f, ', '.join(EXPIRED_FIELDS)))
+        if model._meta.get_field(f).null:
+            values[f] = None
+            blank |= Q(**{'%s__isnull' % f: False})
+        else:
+            values[f] = ''
+            blank |= ~Q(**{f: ''})
+    manager = model._default_manager.using(using)
+    qs = manager.filter(blank, submit_date__lt=before).order_by('submit_date', 'pk')
+    qs = qs.values_list('submit_date', 'pk')
+    updated = 0
+    last = None
+    while True:
+        chunk = qs
+        if last is not None:
+            chunk = qs.filter(Q(submit_date__gt=last[0]) | Q(submit_date=last[0], pk__gt=last[1]))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        last = chunk[-1]
+        with atomic(using=using):
+            updated += manager.filter(pk__in=[pk for date, pk in chunk]).update(**values)
+        if pause:
+            time.sleep(pause)
+    return updated
+
+
+def comment_records(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the comments of ``queryset`` in tree order as dicts, reading
+    ``chunk_size`` of them per query so memory use doesn't depend on the
+    size of the table. Archived comments are yielded decompressed.
+    """
+    from comments.models import ArchivedComment
+    archived = issubclass(queryset.model, ArchivedComment)
+    qs = queryset.order_by('tree_id', 'lft').values(*EXPORT_FIELDS)
+    last = None
+    while True:
+        chunk = qs
+        if last is not None:
+            chunk = qs.filter(Q(tree_id__gt=last[0]) | Q(tree_id=last[0], lft__gt=last[1]))
+        count = 0
+        for row in chunk[:chunk_size].iterator():
+            count += 1
+            last = (row.pop('tree_id'), row.pop('lft'))
+            content_type = ContentType.objects.get_for_id(row.pop('content_type_id'))
+            row['content_type'] = '%s.%s' % (content_type.app_label, content_type.model)
+            row['parent'] = row.pop('parent_id')
+            row['site'] = row.pop('site_id')
+            row['user'] = row.pop('user_id')
+            row['submit_date'] = row['submit_date'].isoformat()
+            if archived:
+                row['title'] = decompress_text(row['title'])
+                row['comment'] = decompress_text(row['comment'])
+            yield row
+        if count < chunk_size:
+            break
+
+
+def flag_records(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the flags of ``queryset`` in primary key order as dicts, reading
+    ``chunk_size`` of them per query.
+    """
+    qs = queryset.order_by('pk').values('id', 'comment_id', 'user_id', 'flag', 'flag_date')
+    last_pk = 0
+    while True:
+        count = 0
+        for row in qs.filter(pk__gt=last_pk)[:chunk_size].iterator():
+            count += 1
+            last_pk = row['id']
+            row['comment'] = row.pop('comment_id')
+            row['user'] = row.pop('user_id')
+            row['flag_date'] = row['flag_date'].isoformat()
+            yield row
+        if count < chunk_size:
+            break
@@ -0,0 +1,87 @@
+"""
+Compressed text for archived comments.
+
+Compressed values are stored in the same text columns as plain ones: a
+marker, the codec name, and the base64 encoded compressed UTF-8 text. Values
+without a valid marker and codec header are plain text, so compression can be
+turned on for an archive which already holds comments. Text is only stored
+compressed when that makes it shorter, which rules out most one-line comments;
+plain text which itself starts with the marker is stored under the ``raw``
+header so it reads back unchanged.
+"""
+
+import base64
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    # Python 2 doesn't ship lzma.
+    lzma = None
+
+from django.utils.encoding import force_bytes, force_text
+
+MARKER = u'\x02'
+RAW = 'raw'
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+}
+if lzma is not None:
+    CODECS['lzma'] = (lzma.compress, lzma.decompress)
+
+# Raised on a value with a valid header but a corrupt body; binascii.Error and
+# encoding errors are ValueErrors, Python 2 raises TypeError on bad base64.
+DECODE_ERRORS = (TypeError, ValueError, zlib.error)
+if lzma is not None:
+    DECODE_ERRORS += (lzma.LZMAError,)
+
+
+def split_header(value):
+    """
+    Return ``(codec, data)`` for a value stored with a marker and codec
+    header, or ``None`` for plain text.
+    """
+    if not value or not value.startswith(MARKER):
+        return None
+    codec, sep, data = value[1:].partition(u':')
+    if not sep or (codec != RAW and codec not in CODECS):
+        return None
+    return codec, data
+
+
+def compress_text(text, codec):
+    """
+    Return the plain ``text`` as stored with ``codec`` (``'zlib'``, ``'lzma'``
+    or ``None``): compressed, or ``text`` itself if compressing doesn't make it
+    shorter.
+    """
+    if not text:
+        return text
+    if codec:
+        compress = CODECS[codec][0]
+        raw = force_bytes(text)
+        compressed = u'%s%s:%s' % (MARKER, codec, force_text(base64.b64encode(compress(raw))))
+        if len(compressed) < len(raw):
+            return compressed
+    if text.startswith(MARKER):
+        return u'%s%s:%s' % (MARKER, RAW, text)
+    return text
+
+
+def decompress_text(value):
+    """
+    Return the text stored in ``value``, decompressing it if needed. Values
+    which don't decode are returned as they are.
+    """
+    header = split_header(value)
+    if header is None:
+        return value
+    codec, data = header
+    if codec == RAW:
+        return data
+    decompress = CODECS[codec][1]
+    try:
+        return force_text(decompress(base64.b64decode(force_bytes(data))))
+    except DECODE_ERRORS:
+        return value
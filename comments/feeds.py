@@ -1,15 +1,83 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.syndication.views import Feed
 from django.contrib.sites.models import get_current_site
+from django.core.cache import get_cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.http import Http404, HttpResponse
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext as _
+from django.views.decorators.http import condition
 
 import comments
+from comments import utils
+
+COMMENTS_FEED_CACHE = getattr(settings, 'COMMENTS_FEED_CACHE', 'default')
+COMMENTS_FEED_CACHE_TIMEOUT = getattr(settings, 'COMMENTS_FEED_CACHE_TIMEOUT', 300)
+
+# Changed to drop all cached feeds.
+FEED_GENERATION_KEY = 'comments.feeds.generation'
+
+
+def invalidate_feeds(sender=None, **kwargs):
+    """
+    Drop all cached feeds. Connected to ``comment_threads_were_changed`` in
+    ``comments.models``, which is loaded wherever comments are changed.
+    """
+    get_cache(COMMENTS_FEED_CACHE).set(FEED_GENERATION_KEY, uuid.uuid4().hex,
+                                       COMMENTS_FEED_CACHE_TIMEOUT)
+
 
 class LatestCommentFeed(Feed):
-    """Feed of latest comments on the current site."""
+    """
+    Feed of latest comments on the current site.
+
+    Rendered feeds are cached for ``COMMENTS_FEED_CACHE_TIMEOUT`` seconds
+    under the URL path and the latest comment they show, so a new comment
+    shows up at once, and are served with an ``ETag`` for conditional GETs.
+    Changing or deleting a comment, or sending
+    ``comment_threads_were_changed``, drops them all.
+    """
+
+    max_items = 40
+
+    # How the latest comment, which a cached feed is checked against, is
+    # looked up; in the order of the items, for the same index.
+    latest_ordering = ('-submit_date', '-pk')
 
     def __call__(self, request, *args, **kwargs):
         self.site = get_current_site(request)
-        return super(LatestCommentFeed, self).__call__(request, *args, **kwargs)
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+        latest = list(self.get_query_set(obj).order_by(*self.latest_ordering)
+                      .values_list('pk', 'submit_date')[:1])
+        latest_pk, latest_date = latest and latest[0] or (None, None)
+
+        cache = get_cache(COMMENTS_FEED_CACHE)
+        key = 'comments.feeds.%s' % hashlib.md5(force_bytes('%s:%s:%s:%s:%s' % (
+            self.site.pk, request.path, latest_pk, latest_date,
+            cache.get(FEED_GENERATION_KEY)))).hexdigest()
+        cached = cache.get(key)
+        if cached is None:
+            feedgen = self.get_feed(obj, request)
+            response = HttpResponse(content_type=feedgen.mime_type)
+            feedgen.write(response, 'utf-8')
+            cached = (response, hashlib.md5(response.content).hexdigest())
+            cache.set(key, cached, COMMENTS_FEED_CACHE_TIMEOUT)
+        response, etag = cached
+
+        # No Last-Modified: the latest date doesn't change when a comment is
+        # removed or edited, the ETag does.
+        @condition(etag_func=lambda request, *args, **kwargs: etag)
+        def view(request, *args, **kwargs):
+            return response
+        return view(request, *args, **kwargs)
 
     def title(self):
         return _("%(site_name)s comments") % dict(site_name=self.site.name)
@@ -20,13 +88,92 @@ class LatestCommentFeed(Feed):
     def description(self):
         return _("Latest comments on %(site_name)s") % dict(site_name=self.site.name)
 
-    def items(self):
-        qs = comments.get_model().objects.filter(
+    def get_query_set(self, obj=None):
+        """
+        The comments the feed shows, in any order.
+        """
+        return comments.get_model().objects.filter(
             site__pk = self.site.pk,
             is_public = True,
             is_removed = False,
         )
-        return qs.order_by('-submit_date')[:40]
+
+    def items(self, obj=None):
+        qs = self.get_query_set(obj).select_related('user', 'site')
+        qs = qs.order_by('-submit_date')[:self.max_items]
+        # Custom comment models may not use CommentManager.
+        if hasattr(qs.model.objects, 'prefetch_content_objects'):
+            return qs.model.objects.prefetch_content_objects(qs)
+        return qs
 
     def item_pubdate(self, item):
         return item.submit_date
+
+    def item_description(self, item):
+        return item.comment
+
+
+class ObjectCommentFeed(LatestCommentFeed):
+    """
+    Feed of the latest comments on one object, given by its content type
+    (as ``app_label.model``) and primary key.
+    """
+
+    def get_object(self, request, content_type, object_pk):
+        try:
+            ctype = ContentType.objects.get_by_natural_key(*content_type.split('.', 1))
+        except (TypeError, ContentType.DoesNotExist):
+            raise Http404('No content type %r.' % content_type)
+        if ctype.model_class() is None:
+            raise Http404('No content type %r.' % content_type)
+        try:
+            return ctype.get_object_for_this_type(pk=object_pk)
+        except (ValueError, ValidationError):
+            raise Http404('Invalid primary key %r.' % object_pk)
+
+    def title(self, obj):
+        return _("Comments on %(object)s") % dict(object=obj)
+
+    def link(self, obj):
+        if hasattr(obj, 'get_absolute_url'):
+            return obj.get_absolute_url()
+        return super(ObjectCommentFeed, self).link()
+
+    def description(self, obj):
+        return _("Latest comments on %(object)s") % dict(object=obj)
+
+    def get_query_set(self, obj=None):
+        return utils.get_query_set(target=obj)
+
+    def items(self, obj=None):
+        qs = self.get_query_set(obj).select_related('user', 'site')
+        items = list(qs.order_by('-submit_date')[:self.max_items])
+        # All of them are on obj.
+        for item in items:
+            item.cache_content_object(obj)
+        return items
+
+
+class UserCommentFeed(LatestCommentFeed):
+    """
+    Feed of the latest comments by one user, given by primary key.
+    """
+
+    def get_object(self, request, user_pk):
+        try:
+            return get_user_model()._default_manager.get(pk=user_pk)
+        except (ValueError, ValidationError):
+            raise Http404('Invalid primary key %r.' % user_pk)
+
+    def title(self, obj):
+        return _("Comments by %(user)s") % dict(user=obj)
+
+    def link(self, obj):
+        return super(UserCommentFeed, self).link()
+
+    def description(self, obj):
+        return _("Latest comments by %(user)s on %(site_name)s") % dict(
+            user=obj, site_name=self.site.name)
+
+    def get_query_set(self, obj=None):
+        return super(UserCommentFeed, self).get_query_set().filter(user=obj)
@@ -0,0 +1,88 @@
+"""
+SimHash fingerprints for near-duplicate comment detection.
+
+A fingerprint is a 64 bit SimHash of the comment's words: comments which
+differ in a few words get fingerprints which differ in a few bits (a changed
+word in a short comment typically flips 4 to 8 bits, while unrelated comments
+differ in 20 or more). To find them without comparing against every stored
+fingerprint, ``FINGERPRINT_BANDS`` bands of ``BAND_BITS`` bits sampled from
+the fingerprint are indexed; only comments sharing a band exactly are
+compared. Fingerprints 5 bits apart share a band with a probability above
+99%, 8 bits apart with a probability of about 87%.
+"""
+
+import hashlib
+import re
+
+from django.utils.encoding import force_bytes
+
+FINGERPRINT_BITS = 64
+FINGERPRINT_BANDS = 16
+BAND_BITS = 16
+
+# The bit positions sampled for each band.
+BAND_POSITIONS = [[(band + i * (2 * band + 1)) % FINGERPRINT_BITS for i in range(BAND_BITS)]
+                  for band in range(FINGERPRINT_BANDS)]
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def simhash(text):
+    """
+    Return the SimHash of ``text`` as a signed 64 bit integer (so it can be
+    stored in a ``BigIntegerField``), or ``None`` if it has no words: all
+    such texts would hash to 0 and look like duplicates of each other.
+    """
+    weights = {}
+    for token in TOKEN_RE.findall(text.lower()):
+        weights[token] = weights.get(token, 0) + 1
+    if not weights:
+        return None
+
+    vector = [0] * FINGERPRINT_BITS
+    for token, weight in weights.items():
+        h = int(hashlib.md5(force_bytes(token)).hexdigest()[:16], 16)
+        for i in range(FINGERPRINT_BITS):
+            if h >> i & 1:
+                vector[i] += weight
+            else:
+                vector[i] -= weight
+
+    fingerprint = 0
+    for i, value in enumerate(vector):
+        if value > 0:
+            fingerprint |= 1 << i
+    if fingerprint >= 1 << (FINGERPRINT_BITS - 1):
+        fingerprint -= 1 << FINGERPRINT_BITS
+    return fingerprint
+
+
+def get_comment_fingerprint(comment):
+    """
+    Return the fingerprint of a comment's text, or ``None`` if it has no
+    words, computing it only once per comment instance.
+    """
+    if not hasattr(comment, '_fingerprint'):
+        comment._fingerprint = simhash(comment.comment)
+    return comment._fingerprint
+
+
+def band_keys(fingerprint):
+    """
+    Return the index keys of the bands of ``fingerprint``; each key encodes
+    the band number along with its value.
+    """
+    keys = []
+    for band, positions in enumerate(BAND_POSITIONS):
+        value = 0
+        for i, position in enumerate(positions):
+            value |= (fingerprint >> position & 1) << i
+        keys.append(band << BAND_BITS | value)
+    return keys
+
+
+def distance(a, b):
+    """
+    Return the number of bits two fingerprints differ in.
+    """
+    return bin((a ^ b) & ((1 << FINGERPRINT_BITS) - 1)).count('1')
@@ -14,7 +14,8 @@ from django.utils.text import get_text_list
 from django.utils import timezone
 from django.utils.translation import ungettext, ugettext, ugettext_lazy as _
 
-from comments.models import Comment, CommentFlag
+from comments.models import ArchivedComment, Comment, CommentFlag
+from comments.posting import save_comment
 
 from comments.utils import CommentPostBadRequest
 
@@ -184,7 +185,7 @@ class CommentForm(forms.ModelForm):
             return COMMENT_MODEL.objects.get(pk=comment_pk, site__pk=settings.SITE_ID)
 
         if parent_pk:
-            self.parent_comment = COMMENT_MODEL.objects.get(pk=parent_pk, site__pk=settings.SITE_ID)
+            self.parent_comment = self.get_parent_comment(parent_pk)
             self.target_object = self.parent_comment.content_object
 
         else:
@@ -212,13 +213,28 @@ class CommentForm(forms.ModelForm):
 
         if self.target_object:
             CommentModel = self.get_comment_model()
-            return CommentModel(**self.get_comment_create_data(**kwargs))
+            comment = CommentModel(**self.get_comment_create_data(**kwargs))
+            # The target is already loaded; moderation, the signal receivers
+            # and get_comment_url shouldn't have to fetch it again.
+            comment.cache_content_object(self.target_object)
+            return comment
 
         else:
             raise Exception("No target found")
 
 
 
+    def get_parent_comment(self, parent_pk):
+        """
+        Return the comment replied to. Archived comments can't be replied to,
+        and a comment posted since with the primary key of an archived one
+        isn't the one meant either, so both raise ``DoesNotExist``.
+        """
+        COMMENT_MODEL = self.get_comment_model()
+        if COMMENT_MODEL is Comment and ArchivedComment.objects.filter(pk=parent_pk).exists():
+            raise COMMENT_MODEL.DoesNotExist("Comment %s is archived." % parent_pk)
+        return COMMENT_MODEL.objects.get(pk=parent_pk, site__pk=settings.SITE_ID)
+
     def get_comment_model(self):
         """
         Get the comment model to create with this form. Subclasses in custom
@@ -400,7 +416,12 @@ class CommentForm(forms.ModelForm):
                 )
 
 
-        comment = super(CommentForm, self).save(commit=commit)
+        if new and commit:
+            # Replies are inserted with their thread locked; see
+            # comments.posting.
+            comment = save_comment(self.instance)
+        else:
+            comment = super(CommentForm, self).save(commit=commit)
 
         if send_signals:
             if new:
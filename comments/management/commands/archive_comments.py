@@ -0,0 +1,43 @@
+import datetime
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils import timezone
+
+from comments import archive
+from comments.compression import CODECS
+
+
+class Command(NoArgsCommand):
+    help = ("Moves the comments on objects which haven't been commented on "
+            "for a while to the archive table.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=365,
+            help='Archive the objects without comments in the last DAYS days.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Archive at most LIMIT objects.'),
+        make_option('--compress', dest='compress', default=None,
+            help='Also compress the archived comments stored uncompressed with '
+                 'CODEC (zlib or lzma).'),
+    )
+
+    def handle_noargs(self, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        objects = archive.archivable_objects(before, options['limit'])
+        count = 0
+        for ctype_id, object_pk in objects:
+            count += archive.archive_object(ContentType.objects.get_for_id(ctype_id), object_pk)
+
+        verbosity = int(options.get('verbosity', 1))
+        if verbosity >= 1:
+            self.stdout.write("Archived %d comment(s) on %d object(s)." % (count, len(objects)))
+
+        if options['compress']:
+            if options['compress'] not in CODECS:
+                raise CommandError("Unknown codec '%s'; use one of %s." %
+                                   (options['compress'], ', '.join(sorted(CODECS))))
+            compressed = archive.compress_archive(options['compress'])
+            if verbosity >= 1:
+                self.stdout.write("Compressed %d archived comment(s)." % compressed)
@@ -0,0 +1,89 @@
+import multiprocessing
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connections
+
+import comments
+from comments import trees
+
+
+def tree_id_chunks(model, chunk_size):
+    """
+    Yield the tree ids in use in lists of ``chunk_size``.
+    """
+    opts = model._mptt_meta
+    qs = model._default_manager.order_by(opts.tree_id_attr).values_list(
+        opts.tree_id_attr, flat=True).distinct()
+    last = None
+    while True:
+        chunk = qs
+        if last is not None:
+            chunk = qs.filter(**{'%s__gt' % opts.tree_id_attr: last})
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        last = chunk[-1]
+        yield chunk
+
+
+def close_connections():
+    # Forked workers mustn't share the parent's database connections.
+    for connection in connections.all():
+        connection.close()
+
+
+def check_chunk(args):
+    tree_ids, repair = args
+    broken, repaired = trees.check_trees(comments.get_model(), tree_ids, repair)
+    return len(tree_ids), broken, repaired
+
+
+class Command(NoArgsCommand):
+    help = ("Checks the tree fields (lft, rght, level) of every comment thread, "
+            "and optionally repairs the broken threads one by one.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair', default=False,
+            help='Renumber the threads found broken.'),
+        make_option('--processes', dest='processes', type='int', default=1,
+            help='Number of worker processes checking threads in parallel.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+            help='Number of threads checked per task.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        tasks = ((chunk, options['repair'])
+                 for chunk in tree_id_chunks(comments.get_model(), options['chunk_size']))
+
+        pool = None
+        if options['processes'] > 1:
+            close_connections()
+            pool = multiprocessing.Pool(options['processes'], initializer=close_connections)
+            results = pool.imap_unordered(check_chunk, tasks)
+        else:
+            results = (check_chunk(task) for task in tasks)
+
+        checked = 0
+        broken, repaired = [], []
+        try:
+            for count, chunk_broken, chunk_repaired in results:
+                checked += count
+                broken.extend(chunk_broken)
+                repaired.extend(chunk_repaired)
+                if verbosity >= 1:
+                    self.stdout.write("Checked %d thread(s): %d broken, %d repaired." %
+                                      (checked, len(broken), len(repaired)))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if verbosity >= 2 and broken:
+            self.stdout.write("Broken tree ids: %s" % ', '.join(str(t) for t in sorted(broken)))
+        if options['repair'] and len(repaired) < len(broken):
+            unrepaired = sorted(set(broken) - set(repaired))
+            raise CommandError("Threads %s can't be repaired on their own; rebuild all "
+                               "trees with Comment.tree.rebuild()." %
+                               ', '.join(str(t) for t in unrepaired))
@@ -0,0 +1,51 @@
+import datetime
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils import timezone
+
+import comments
+from comments import bulk
+from comments.models import ArchivedComment, Comment
+
+COMMENTS_RETENTION_DAYS = getattr(settings, 'COMMENTS_RETENTION_DAYS', None)
+
+
+class Command(NoArgsCommand):
+    help = ("Blanks the IP addresses and email addresses of comments older than "
+            "a number of days, a chunk at a time.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=COMMENTS_RETENTION_DAYS,
+            help='Expire the data of comments older than DAYS days. Defaults to '
+                 'the COMMENTS_RETENTION_DAYS setting.'),
+        make_option('--fields', dest='fields', default=','.join(bulk.DEFAULT_EXPIRED_FIELDS),
+            help='Comma separated fields to blank, among %s.' % ', '.join(bulk.EXPIRED_FIELDS)),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=bulk.IMPORT_CHUNK_SIZE,
+            help='Number of comments updated per transaction.'),
+        make_option('--pause', dest='pause', type='float', default=0,
+            help='Seconds to wait between two chunks.'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['days'] is None:
+            raise CommandError("Give the age of the data to expire with --days or "
+                               "the COMMENTS_RETENTION_DAYS setting.")
+        fields = [f.strip() for f in options['fields'].split(',') if f.strip()]
+        unknown = set(fields) - set(bulk.EXPIRED_FIELDS)
+        if unknown:
+            raise CommandError("Can't expire %s; use some of %s." % (
+                ', '.join(sorted(unknown)), ', '.join(bulk.EXPIRED_FIELDS)))
+
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        models = [comments.get_model()]
+        if models[0] is Comment:
+            models.append(ArchivedComment)
+        count = 0
+        for model in models:
+            count += bulk.expire_personal_data(before, fields, model, options['chunk_size'],
+                                               options['pause'])
+
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Expired the data of %d comment(s)." % count)
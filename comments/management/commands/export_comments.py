@@ -0,0 +1,100 @@
+import datetime
+import gzip
+import io
+import itertools
+import json
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+import comments
+from comments import bulk
+from comments.models import ArchivedComment, Comment, CommentFlag
+
+
+def parse_limit(value, name):
+    """
+    Parse a --since or --until value, a date or a date and time.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError("Invalid %s value: %r" % (name, value))
+        parsed = datetime.datetime.combine(date, datetime.time())
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
+class Command(NoArgsCommand):
+    help = ("Exports comments (or their flags) as JSON lines, one per line, "
+            "in the format import_comments reads.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--output', dest='output', default='-',
+            help='File to write to, gzipped if its name ends in .gz. Defaults to standard output.'),
+        make_option('--flags', action='store_true', dest='flags', default=False,
+            help='Export the flags of the selected comments instead of the comments.'),
+        make_option('--site', dest='site', type='int', default=None,
+            help='Only export comments posted on the site with this id.'),
+        make_option('--content-type', action='append', dest='content_types', default=[],
+            help='Only export comments on this model, given as app_label.model. Can be repeated.'),
+        make_option('--since', dest='since', default=None,
+            help='Only export comments submitted at or after this date (and time).'),
+        make_option('--until', dest='until', default=None,
+            help='Only export comments submitted before this date (and time).'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=bulk.EXPORT_CHUNK_SIZE,
+            help='Number of rows read per query.'),
+    )
+
+    def handle_noargs(self, **options):
+        filters = {}
+        if options['site'] is not None:
+            filters['site'] = options['site']
+        if options['content_types']:
+            try:
+                filters['content_type__in'] = [
+                    ContentType.objects.get_by_natural_key(*label.split('.', 1))
+                    for label in options['content_types']]
+            except (TypeError, ContentType.DoesNotExist):
+                raise CommandError("Unknown content type in %s." % ', '.join(options['content_types']))
+        if options['since']:
+            filters['submit_date__gte'] = parse_limit(options['since'], '--since')
+        if options['until']:
+            filters['submit_date__lt'] = parse_limit(options['until'], '--until')
+
+        if options['flags']:
+            qs = CommentFlag.objects.filter(**dict(('comment__%s' % k, v) for k, v in filters.items()))
+            records = bulk.flag_records(qs, options['chunk_size'])
+        else:
+            model = comments.get_model()
+            records = bulk.comment_records(model.objects.filter(**filters), options['chunk_size'])
+            if model is Comment:
+                # Followed by the comments on archived objects.
+                archived = ArchivedComment.objects.filter(**filters)
+                records = itertools.chain(records, bulk.comment_records(archived, options['chunk_size']))
+
+        path = options['output']
+        if path == '-':
+            stream = self.stdout
+        elif path.endswith('.gz'):
+            stream = io.TextIOWrapper(gzip.open(path, 'wb'), encoding='utf-8')
+        else:
+            stream = io.open(path, 'w', encoding='utf-8')
+
+        count = 0
+        try:
+            for record in records:
+                stream.write(json.dumps(record, ensure_ascii=False) + u'\n')
+                count += 1
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+
+        if int(options.get('verbosity', 1)) >= 1 and path != '-':
+            self.stdout.write("Exported %d row(s)." % count)
@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+import comments
+from comments import bulk
+from comments.models import ArchivedComment, Comment
+
+
+class Command(NoArgsCommand):
+    help = ("Sets the integer object keys of the comments saved without them, "
+            "such as those saved before the column was added.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=bulk.IMPORT_CHUNK_SIZE,
+            help='Number of comments read per query.'),
+    )
+
+    def handle_noargs(self, **options):
+        models = [comments.get_model()]
+        if models[0] is Comment:
+            models.append(ArchivedComment)
+        count = 0
+        for model in models:
+            count += bulk.fill_object_pk_ints(model, options['chunk_size'])
+
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Updated %d comment(s)." % count)
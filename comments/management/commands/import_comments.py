@@ -0,0 +1,58 @@
+import gzip
+import io
+import json
+import sys
+from optparse import make_option
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from comments import bulk
+
+
+def read_records(path):
+    """
+    Yield the records of a JSON lines file, which may be gzipped; ``-``
+    reads standard input.
+    """
+    if path == '-':
+        stream = sys.stdin
+    elif path.endswith('.gz'):
+        stream = io.TextIOWrapper(io.BufferedReader(gzip.open(path)), encoding='utf-8')
+    else:
+        stream = io.open(path, encoding='utf-8')
+    try:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+class Command(BaseCommand):
+    args = '<file file ...>'
+    help = ("Imports comments from JSON lines files (one comment per line, "
+            "threads in tree order), such as those written by export_comments.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=bulk.IMPORT_CHUNK_SIZE,
+            help='Number of comments written per INSERT.'),
+    )
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("Give the files to import, or - to read standard input.")
+
+        def records():
+            for path in paths:
+                for record in read_records(path):
+                    yield record
+
+        try:
+            count = bulk.import_comments(records(), chunk_size=options['chunk_size'])
+        except (ValueError, KeyError, ObjectDoesNotExist) as e:
+            raise CommandError("Invalid comment record: %s" % e)
+
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Imported %d comment(s)." % count)
@@ -0,0 +1,20 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.utils import timezone
+
+from comments.models import CommentFingerprint
+
+
+class Command(NoArgsCommand):
+    help = "Deletes the near-duplicate fingerprints of old comments."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=7,
+            help='Keep the fingerprints of comments submitted in the last DAYS days.'),
+    )
+
+    def handle_noargs(self, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        CommentFingerprint.objects.expire(before)
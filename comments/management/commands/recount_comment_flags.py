@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from comments import bulk
+
+
+class Command(NoArgsCommand):
+    help = ("Sets the flag counters of the comments from their flags, such as "
+            "on the comments flagged before the counters were kept.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=bulk.IMPORT_CHUNK_SIZE,
+            help='Number of comments recounted per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        count = bulk.recount_flag_counters(options['chunk_size'])
+
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Updated %d comment(s)." % count)
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+import comments
+from comments import spam
+from comments.posting import atomic
+
+
+class Command(NoArgsCommand):
+    help = "Re-scores the comments in the moderation queue with the spam classifier."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Number of comments scored at a time.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Score all comments, not just those awaiting moderation.'),
+    )
+
+    def handle_noargs(self, **options):
+        classifier = spam.get_classifier()
+        if classifier is None:
+            raise CommandError("No spam classifier has been trained; run train_spam_classifier first.")
+
+        model = comments.get_model()
+        if options['all']:
+            qs = model.objects.all()
+        else:
+            qs = model.objects.in_moderation()
+        qs = qs.order_by('pk').values_list('pk', *spam.TEXT_FIELDS)
+
+        scored = 0
+        last_pk = 0
+        while True:
+            batch = list(qs.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            scores = classifier.score_many([' '.join(row[1:]) for row in batch])
+            with atomic():
+                for row, score in zip(batch, scores):
+                    model.objects.filter(pk=row[0]).update(spam_score=score)
+            scored += len(batch)
+
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Scored %d comment(s)." % scored)
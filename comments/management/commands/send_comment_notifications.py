@@ -0,0 +1,43 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from comments.notifications import (queue_digest_notifications,
+    send_queued_notifications, NOTIFICATION_BATCH_SIZE, NOTIFICATION_MAX_ATTEMPTS)
+
+
+class Command(NoArgsCommand):
+    help = ("Queues due comment digests and sends the comment notifications "
+            "waiting in the outbox.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=NOTIFICATION_BATCH_SIZE,
+            help='Number of notifications fetched from the outbox at a time.'),
+        make_option('--max-attempts', dest='max_attempts', type='int',
+            default=NOTIFICATION_MAX_ATTEMPTS,
+            help='Give up on a notification after this many failed attempts.'),
+        make_option('--interval', dest='interval', type='int', default=0,
+            help='Keep running, polling the outbox every INTERVAL seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        interval = options['interval']
+
+        while True:
+            queued = queue_digest_notifications()
+            if verbosity >= 1 and queued:
+                self.stdout.write("Queued %d digest notification(s)." % queued)
+
+            sent, failed = send_queued_notifications(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+            )
+            if verbosity >= 1 and (sent or failed or not interval):
+                self.stdout.write("Sent %d notification(s), %d failed." % (sent, failed))
+
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+import comments
+from comments import spam
+
+
+class Command(NoArgsCommand):
+    help = ("Trains the comment spam classifier from public (ham) and "
+            "removed (spam) comments.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--output', dest='output', default=spam.COMMENTS_SPAM_MODEL,
+            help='File to store the model in. Defaults to the COMMENTS_SPAM_MODEL setting.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Only train on the LIMIT most recent comments of each kind.'),
+        make_option('--features', dest='n_features', type='int', default=2 ** 18,
+            help='Number of hashed token features.'),
+    )
+
+    def handle_noargs(self, **options):
+        if not options['output']:
+            raise CommandError("Set COMMENTS_SPAM_MODEL or pass --output.")
+
+        classifier = spam.get_classifier_class()(n_features=options['n_features'])
+        qs = comments.get_model().objects.order_by('-submit_date')
+        for is_spam, examples in ((False, qs.filter(is_public=True, is_removed=False)),
+                                  (True, qs.filter(is_removed=True))):
+            examples = examples.values_list(*spam.TEXT_FIELDS)
+            if options['limit']:
+                examples = examples[:options['limit']]
+            classifier.train((' '.join(fields) for fields in examples.iterator()), is_spam)
+
+        classifier.save(options['output'])
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Trained on %(ham)d ham and %(spam)d spam comments." % classifier.doc_counts)
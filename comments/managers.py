@@ -1,8 +1,77 @@
-from django.db import models
+import re
+
+from django.conf import settings
+from django.db import models, router
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.encoding import force_text
+from mptt.managers import TreeManager
+
+from comments.fingerprints import band_keys, distance
+
+INTEGER_PK_RE = re.compile(r'^-?(0|[1-9][0-9]{0,18})$')
+
+# The range of the object_pk_int column (a BigIntegerField).
+MAX_INTEGER_PK = 2 ** 63 - 1
+
+# Whether comments on objects with integer keys are looked up on
+# object_pk_int. Comments saved before the column was added don't have it
+# until fill_object_pk_ints has run, so it's off unless turned on.
+COMMENTS_INTEGER_OBJECT_PKS = getattr(settings, 'COMMENTS_INTEGER_OBJECT_PKS', False)
+
+
+def integer_pk(object_pk):
+    """
+    Return ``object_pk`` as an integer if it is the text of one the
+    ``object_pk_int`` column can hold, or ``None``. Keys with leading zeros
+    or signs other than ``-`` aren't integer keys: ``"007"`` and ``"7"`` are
+    different objects to a text key.
+    """
+    object_pk = force_text(object_pk)
+    if INTEGER_PK_RE.match(object_pk):
+        value = int(object_pk)
+        if -MAX_INTEGER_PK <= value <= MAX_INTEGER_PK:
+            return value
+    return None
+
+
+def object_pk_lookup(model, object_pk):
+    """
+    Return the filter arguments selecting the comments of ``model`` on the
+    object with the primary key ``object_pk``, which compare integers on
+    models with an ``object_pk_int`` column when the key is one and
+    ``COMMENTS_INTEGER_OBJECT_PKS`` is on.
+    """
+    object_pk = force_text(object_pk)
+    if not COMMENTS_INTEGER_OBJECT_PKS:
+        return {'object_pk': object_pk}
+    value = integer_pk(object_pk)
+    if value is not None and 'object_pk_int' in [f.name for f in model._meta.fields]:
+        return {'object_pk_int': value}
+    return {'object_pk': object_pk}
+
+
+class CommentTreeManager(TreeManager):
+    """
+    The manager django-mptt uses to maintain the comment trees.
+
+    New tree ids are taken from ``CommentTreeId`` instead of being computed
+    as one more than the largest tree id in use, which scans the comments
+    table and hands out the same id to concurrent posts.
+    """
+
+    def _get_next_tree_id(self):
+        from comments.models import CommentTreeId
+        return CommentTreeId.allocate(router.db_for_write(self.model))
 
-class CommentManager(models.Manager):
+
+class CommentManager(CommentTreeManager):
+    """
+    The default comment manager. It's a tree manager, so it's the one mptt
+    uses for the comment trees whichever version of mptt picks it.
+    """
 
     def in_moderation(self):
         """
@@ -10,6 +79,45 @@ class CommentManager(models.Manager):
         """
         return self.get_query_set().filter(is_public=False, is_removed=False)
 
+    def moderation_queue(self, after=None):
+        """
+        QuerySet for the moderation queue in order of priority: the comments
+        with the most removal suggestions first, and the oldest first among
+        those with the same number of suggestions.
+
+        Pass the primary key of the last comment of a page as ``after`` to
+        get the comments following it (keyset paging), which stays fast
+        however deep into the queue a moderator gets.
+        """
+        qs = self.in_moderation()
+        if after is not None:
+            last = self.get_query_set().values('pk', 'suggest_removal_count', 'submit_date').get(pk=after)
+            count, date = last['suggest_removal_count'], last['submit_date']
+            qs = qs.filter(
+                Q(suggest_removal_count__lt=count) |
+                Q(suggest_removal_count=count, submit_date__gt=date) |
+                Q(suggest_removal_count=count, submit_date=date, pk__gt=last['pk'])
+            )
+        return qs.order_by('-suggest_removal_count', 'submit_date', 'pk')
+
+    def for_user(self, user, after=None):
+        """
+        QuerySet for the public comments of ``user`` (a user or its primary
+        key) on the current site, the newest first.
+
+        Like ``moderation_queue``, pass the primary key of the last comment
+        of a page as ``after`` to get the comments following it.
+        """
+        qs = self.get_query_set().filter(user=user, site__pk=settings.SITE_ID,
+                                         is_public=True, is_removed=False)
+        if after is not None:
+            last = self.get_query_set().values('pk', 'submit_date').get(pk=after)
+            qs = qs.filter(
+                Q(submit_date__lt=last['submit_date']) |
+                Q(submit_date=last['submit_date'], pk__lt=last['pk'])
+            )
+        return qs.order_by('-submit_date', '-pk')
+
     def for_model(self, model):
         """
         QuerySet for all comments for a particular model (either an instance or
@@ -18,5 +126,106 @@ class CommentManager(models.Manager):
         ct = ContentType.objects.get_for_model(model)
         qs = self.get_query_set().filter(content_type=ct)
         if isinstance(model, models.Model):
-            qs = qs.filter(object_pk=force_text(model._get_pk_val()))
+            qs = qs.filter(**object_pk_lookup(self.model, model._get_pk_val()))
+        return qs
+
+    def prefetch_content_objects(self, comments):
+        """
+        Load the objects ``comments`` (an iterable of comments, such as a
+        QuerySet of them) are attached to with one query per content type,
+        and cache them on the comments so reading ``content_object`` doesn't
+        query. Comments on deleted objects get ``None``. Returns the
+        comments as a list.
+        """
+        comments = list(comments)
+        keys = {}
+        wanted = []
+        for comment in comments:
+            key = self._content_object_key(comment)
+            if key is not None:
+                keys.setdefault(key[0], set()).add(key[1])
+            wanted.append((comment, key))
+
+        objects = {}
+        for model, pks in keys.items():
+            for obj in model._default_manager.filter(pk__in=pks):
+                objects[(model, obj._get_pk_val())] = obj
+
+        for comment, key in wanted:
+            comment.cache_content_object(objects.get(key))
+        return comments
+
+    def _content_object_key(self, comment):
+        """
+        Return the ``(model, pk)`` of the object ``comment`` is attached to,
+        or ``None`` if its model is gone or the key isn't valid for it.
+        """
+        model = ContentType.objects.get_for_id(comment.content_type_id).model_class()
+        if model is None:
+            return None
+        value = getattr(comment, 'object_pk_int', None)
+        if value is None:
+            value = comment.object_pk
+        try:
+            return model, model._meta.pk.to_python(value)
+        except ValidationError:
+            return None
+
+
+class CommentNotificationManager(models.Manager):
+
+    def pending(self, max_attempts=None):
+        """
+        QuerySet for all notifications which still have to be delivered.
+        """
+        qs = self.get_query_set().filter(sent_date__isnull=True)
+        if max_attempts:
+            qs = qs.filter(attempts__lt=max_attempts)
         return qs
+
+    def enqueue(self, subject, message, from_email, recipient_list, comment=None, digest_until=None):
+        """
+        Store an email in the outbox; it will be sent by the
+        ``send_comment_notifications`` management command.
+        """
+        return self.create(
+            comment = comment,
+            subject = subject,
+            message = message,
+            from_email = from_email,
+            recipients = '\n'.join(recipient_list),
+            created_date = timezone.now(),
+            digest_until = digest_until,
+        )
+
+
+class CommentFingerprintManager(models.Manager):
+
+    def near_duplicates(self, fingerprint, since, max_distance):
+        """
+        Return the primary keys of the comments submitted after ``since``
+        whose fingerprint differs from ``fingerprint`` in at most
+        ``max_distance`` bits.
+        """
+        candidates = self.get_query_set().filter(
+            band_key__in = band_keys(fingerprint),
+            submit_date__gt = since,
+        ).values_list('comment_id', 'fingerprint')
+        return sorted(set(pk for pk, other in candidates
+                          if distance(fingerprint, other) <= max_distance))
+
+    def add(self, comment, fingerprint):
+        """
+        Store the fingerprint of a saved comment.
+        """
+        self.bulk_create([
+            self.model(comment=comment, band_key=key, fingerprint=fingerprint,
+                       submit_date=comment.submit_date)
+            for key in band_keys(fingerprint)
+        ])
+
+    def expire(self, before):
+        """
+        Delete the fingerprints of comments submitted before ``before``.
+        """
+        self.get_query_set().filter(submit_date__lt=before).delete()
@@ -1,20 +1,36 @@
+import threading
+
 from django.conf import settings
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
-from django.db import models
+from django.core.mail import EmailMessage
+from django.core.management.color import no_style
+from django.db import connections, models, router, IntegrityError
+from django.db.models import Max
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.functional import cached_property
 from mptt.models import MPTTModel, TreeForeignKey
 
-from comments.managers import CommentManager
+from comments import signals
+from comments.compression import decompress_text
+from comments.managers import (CommentManager, CommentTreeManager,
+    CommentFingerprintManager, CommentNotificationManager, integer_pk)
+from comments.posting import atomic
 
 COMMENT_MAX_LENGTH = getattr(settings, 'COMMENT_MAX_LENGTH', 3000)
 COMMENT_PATH_SEPARATOR = getattr(settings, 'COMMENT_PATH_SEPARATOR', '/')
 COMMENT_PATH_DIGITS = getattr(settings, 'COMMENT_PATH_DIGITS', 10)
+COMMENTS_APPEND_ONLY = getattr(settings, 'COMMENTS_APPEND_ONLY', True)
+
+# The comment fields CommentFlag keeps up to date with F() updates. Saving
+# a comment reads them again first, so an instance loaded before a flag was
+# added doesn't overwrite them.
+FLAG_COUNTER_FIELDS = ('flag_count', 'suggest_removal_count',
+                       'moderator_deletion_count', 'moderator_approval_count')
 
 
 class BaseCommentAbstractModel(models.Model):
@@ -27,7 +43,7 @@ class BaseCommentAbstractModel(models.Model):
     content_type = models.ForeignKey(ContentType,
             verbose_name=_('content type'),
             related_name="content_type_set_for_%(class)s")
-    object_pk = models.TextField(_('object ID'))
+    object_pk = models.CharField(_('object ID'), max_length=255)
     content_object = generic.GenericForeignKey(ct_field="content_type", fk_field="object_pk")
 
     # Metadata about the comment
@@ -36,6 +52,13 @@ class BaseCommentAbstractModel(models.Model):
     class Meta:
         abstract = True
 
+    def cache_content_object(self, obj):
+        """
+        Cache an already loaded content object on this comment, so accessing
+        ``content_object`` doesn't fetch it from the database again.
+        """
+        setattr(self, self.__class__.content_object.cache_attr, obj)
+
     def get_content_object_url(self):
         """
         Get a URL suitable for redirecting to the content object.
@@ -47,9 +70,9 @@ class BaseCommentAbstractModel(models.Model):
 
 
 @python_2_unicode_compatible
-class Comment(MPTTModel, BaseCommentAbstractModel):
+class CommentAbstractModel(MPTTModel, BaseCommentAbstractModel):
     """
-    A user comment about some object.
+    The fields and behaviour shared by comments and archived comments.
     """
 
     parent = TreeForeignKey('self', null=True, blank=True,  default=None, related_name='children', verbose_name=_('Parent'))
@@ -66,8 +89,13 @@ class Comment(MPTTModel, BaseCommentAbstractModel):
     title = models.TextField(_('Title'), blank=True)
     comment = models.TextField(_('comment'), max_length=COMMENT_MAX_LENGTH)
 
+    # object_pk as an integer, for objects with integer primary keys. The
+    # comments on those are looked up on it; see managers.object_pk_lookup.
+    object_pk_int = models.BigIntegerField(_('object ID (integer)'), blank=True,
+                                           null=True, editable=False)
+
     # Metadata about the comment
-    submit_date = models.DateTimeField(_('date/time submitted'), default=None)
+    submit_date = models.DateTimeField(_('date/time submitted'), default=None, db_index=True)
     ip_address = models.GenericIPAddressField(_('IP address'), unpack_ipv4=True, blank=True, null=True)
     is_public = models.BooleanField(_('is public'), default=True,
                     help_text=_('Uncheck this box to make the comment effectively ' \
@@ -77,8 +105,16 @@ class Comment(MPTTModel, BaseCommentAbstractModel):
                                 'A "This comment has been removed" message will ' \
                                 'be displayed instead.'))
 
-    # Manager
-    objects = CommentManager()
+    # Denormalized flag counters, kept up to date by CommentFlag so listings
+    # and moderation rules can read them without aggregating the flags.
+    flag_count = models.PositiveIntegerField(_('flag count'), default=0, editable=False)
+    suggest_removal_count = models.PositiveIntegerField(_('removal suggestion count'), default=0, editable=False)
+    moderator_deletion_count = models.PositiveIntegerField(_('moderator deletion count'), default=0, editable=False)
+    moderator_approval_count = models.PositiveIntegerField(_('moderator approval count'), default=0, editable=False)
+
+    # Probability of the comment being spam, as estimated by the spam
+    # classifier; see comments.spam.
+    spam_score = models.FloatField(_('spam score'), blank=True, null=True, editable=False)
 
     class MPTTMeta:
         # comments on one level will be ordered by date of creation
@@ -88,12 +124,21 @@ class Comment(MPTTModel, BaseCommentAbstractModel):
 
 
     class Meta:
-        db_table = "comments"
-        ordering=['tree_id','lft']
-        #ordering = ('submit_date',)
-        permissions = [("can_moderate", "Can moderate comments")]
-        verbose_name = _('comment')
-        verbose_name_plural = _('comments')
+        abstract = True
+        # The comment lists and counts of an object: its threads in tree
+        # order (the count stops at is_removed), its root comments by date,
+        # and its latest comments (for feeds). Roots are filtered on parent
+        # and ordered by level as well. Each comes in two: objects are looked
+        # up on object_pk, or on object_pk_int for integer keys when
+        # COMMENTS_INTEGER_OBJECT_PKS is on.
+        index_together = [
+            ('content_type', 'object_pk', 'site', 'is_public', 'is_removed', 'tree_id', 'lft'),
+            ('content_type', 'object_pk', 'site', 'parent', 'level', 'submit_date'),
+            ('content_type', 'object_pk', 'site', 'submit_date'),
+            ('content_type', 'object_pk_int', 'site', 'is_public', 'is_removed', 'tree_id', 'lft'),
+            ('content_type', 'object_pk_int', 'site', 'parent', 'level', 'submit_date'),
+            ('content_type', 'object_pk_int', 'site', 'submit_date'),
+        ]
 
     def __str__(self):
         return "%s: %s" % (self.name, self.title)
@@ -110,23 +155,6 @@ class Comment(MPTTModel, BaseCommentAbstractModel):
     #def root_path(self):
     #    return Comment.objects.filter(pk__in=self.tree_path.split(COMMENT_PATH_SEPARATOR)[:-1])
 
-    def save(self, *args, **kwargs):
-        #skip_tree_path = kwargs.pop('skip_tree_path', False)
-        if self.submit_date is None:
-            self.submit_date = timezone.now()
-
-        super(Comment, self).save(*args, **kwargs)
-
-        #if skip_tree_path:
-        #    return None
-
-        #tree_path = unicode(self.pk).zfill(COMMENT_PATH_DIGITS)
-        #if self.parent:
-        #    tree_path = COMMENT_PATH_SEPARATOR.join((self.parent.tree_path, tree_path))
-
-        #self.tree_path = tree_path
-        #Comment.objects.filter(pk=self.pk).update(tree_path=self.tree_path)
-
     def _get_userinfo(self):
         """
         Get a dictionary that pulls together information about the poster
@@ -200,6 +228,212 @@ class Comment(MPTTModel, BaseCommentAbstractModel):
         return _('Posted by %(user)s at %(date)s\n\n%(comment)s\n\nhttp://%(domain)s%(url)s') % d
 
 
+class Comment(CommentAbstractModel):
+    """
+    A user comment about some object.
+    """
+
+    # Manager; the tree manager mptt uses as well.
+    objects = CommentManager()
+    tree = CommentTreeManager()
+
+    class Meta(CommentAbstractModel.Meta):
+        db_table = "comments"
+        index_together = CommentAbstractModel.Meta.index_together + [
+            # The moderation queue.
+            ('is_public', 'is_removed', 'suggest_removal_count', 'submit_date'),
+            # The latest comments of a user.
+            ('user', 'site', 'submit_date'),
+        ]
+        ordering=['tree_id','lft']
+        #ordering = ('submit_date',)
+        permissions = [("can_moderate", "Can moderate comments")]
+        verbose_name = _('comment')
+        verbose_name_plural = _('comments')
+
+    def save(self, *args, **kwargs):
+        #skip_tree_path = kwargs.pop('skip_tree_path', False)
+        # A comment dated as it's saved is newer than any of its siblings.
+        newest = self.submit_date is None
+        if newest:
+            self.submit_date = timezone.now()
+        self.object_pk_int = integer_pk(self.object_pk)
+
+        opts = self._mptt_meta
+        inserting = self.pk is None and not getattr(self, opts.left_attr)
+        if inserting and self.parent_id is None:
+            # Bring an archived conversation back, so the comment is listed
+            # with it rather than left where nobody reads.
+            from comments import archive
+            if archive.is_archived(self.content_type_id, self.object_pk):
+                archive.restore_object(self.content_type_id, self.object_pk, kwargs.get('using'))
+            # A root comment starts a tree of its own. Setting up its tree
+            # fields here skips mptt's ordered insertion of roots, which
+            # looks for its place among the roots of all objects and shifts
+            # the tree ids of every later thread when the comment is
+            # backdated. Listings order root comments by date themselves.
+            setattr(self, opts.tree_id_attr, self._tree_manager._get_next_tree_id())
+            setattr(self, opts.left_attr, 1)
+            setattr(self, opts.right_attr, 2)
+            setattr(self, opts.level_attr, 0)
+        elif inserting and newest and COMMENTS_APPEND_ONLY:
+            # Ordering by date would put the reply last among its siblings
+            # anyway; skip the query mptt makes to look for a later one.
+            # Backdated replies (imports, say) still go through it. The
+            # parent instance may predate other replies saved since, so its
+            # place in the tree is read again first, as mptt does.
+            manager = type(self)._default_manager.using(kwargs.get('using') or self._state.db)
+            self.parent = manager.get(pk=self.parent_id)
+            self._tree_manager.insert_node(self, self.parent, 'last-child')
+
+        if (self.pk is not None and not self._state.adding and len(args) < 4
+                and kwargs.get('update_fields') is None):
+            # Take the flag counters from the row, locked until it's saved,
+            # rather than write back the ones this instance was loaded with.
+            using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+            with atomic(using=using):
+                rows = type(self)._default_manager.using(using).select_for_update().filter(
+                    pk=self.pk).values(*FLAG_COUNTER_FIELDS)
+                for row in rows:
+                    self.__dict__.update(row)
+                super(Comment, self).save(*args, **kwargs)
+        else:
+            super(Comment, self).save(*args, **kwargs)
+
+        #if skip_tree_path:
+        #    return None
+
+        #tree_path = unicode(self.pk).zfill(COMMENT_PATH_DIGITS)
+        #if self.parent:
+        #    tree_path = COMMENT_PATH_SEPARATOR.join((self.parent.tree_path, tree_path))
+
+        #self.tree_path = tree_path
+        #Comment.objects.filter(pk=self.pk).update(tree_path=self.tree_path)
+
+
+class ArchivedComment(CommentAbstractModel):
+    """
+    A comment moved to the archive along with the rest of the comments on its
+    object (see ``comments.archive``). Archived comments are read-only.
+    """
+
+    objects = CommentManager()
+
+    class Meta(CommentAbstractModel.Meta):
+        db_table = "comments_archive"
+        ordering = ['tree_id', 'lft']
+        verbose_name = _('archived comment')
+        verbose_name_plural = _('archived comments')
+
+    def save(self, *args, **kwargs):
+        raise NotImplementedError("Archived comments are read-only; restore them "
+                                  "with comments.archive.restore_object() to change them.")
+
+
+def decompress_archived_comment(sender, instance, **kwargs):
+    # Archived comments may be stored compressed; see comments.archive.
+    instance.title = decompress_text(instance.title)
+    instance.comment = decompress_text(instance.comment)
+
+models.signals.post_init.connect(decompress_archived_comment, sender=ArchivedComment)
+
+
+def invalidate_feeds(sender, **kwargs):
+    # Bulk operations run from shells and management commands, where the
+    # feeds module isn't imported, so its receiver is connected here.
+    from comments import feeds
+    feeds.invalidate_feeds(sender, **kwargs)
+
+signals.comment_threads_were_changed.connect(invalidate_feeds)
+
+
+# Set by comments.archive while it deletes the comments it moves, which it
+# follows with one comment_threads_were_changed for all of them.
+_moving_comments = threading.local()
+
+
+def comment_changed(sender, instance, created=False, **kwargs):
+    # Removing, approving, editing or deleting a comment changes the feeds
+    # it's in; new comments are picked up by the feeds themselves.
+    if (isinstance(instance, BaseCommentAbstractModel) and not created
+            and not getattr(_moving_comments, 'active', False)):
+        invalidate_feeds(sender)
+
+models.signals.post_save.connect(comment_changed)
+models.signals.post_delete.connect(comment_changed)
+
+
+class ArchivedObject(models.Model):
+    """
+    Records that the comments on an object have been moved to the archive.
+    """
+    content_type = models.ForeignKey(ContentType, verbose_name=_('content type'),
+                                     related_name="archived_comment_objects")
+    object_pk = models.CharField(_('object ID'), max_length=255)
+    archived_date = models.DateTimeField(_('date archived'), default=None)
+
+    class Meta:
+        db_table = 'comments_archived_objects'
+        unique_together = [('content_type', 'object_pk')]
+        verbose_name = _('archived object')
+        verbose_name_plural = _('archived objects')
+
+    def save(self, *args, **kwargs):
+        if self.archived_date is None:
+            self.archived_date = timezone.now()
+        super(ArchivedObject, self).save(*args, **kwargs)
+
+
+class CommentTreeId(models.Model):
+    """
+    Allocates the tree ids of comment threads from the primary key sequence
+    of its table, so starting a thread takes neither a scan of the comments
+    table nor a lock shared with threads on other objects.
+    """
+    # The databases on which this process made sure the sequence starts
+    # above the tree ids allocated before this table was used.
+    _seeded = set()
+
+    class Meta:
+        db_table = 'comments_tree_ids'
+
+    @classmethod
+    def allocate(cls, using=None):
+        """
+        Return a tree id no other comment thread uses.
+        """
+        using = using or router.db_for_write(cls)
+        with atomic(using=using):
+            if using not in cls._seeded:
+                cls.seed(using)
+            return cls.objects.using(using).create().pk
+
+    @classmethod
+    def seed(cls, using=None):
+        """
+        Start the sequence above the largest tree id in use if nothing was
+        allocated from it yet, which is the case on sites that had comments
+        before it existed.
+        """
+        using = using or router.db_for_write(cls)
+        if not cls.objects.using(using).exists():
+            start = Comment._default_manager.using(using).aggregate(start=Max('tree_id'))['start']
+            if start:
+                try:
+                    with atomic(using=using):
+                        cls.objects.using(using).create(pk=start)
+                except IntegrityError:
+                    # Another process seeded it first, sequence and all.
+                    pass
+                else:
+                    # Backends with sequences don't move them past explicit keys.
+                    connection = connections[using]
+                    cursor = connection.cursor()
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [cls]):
+                        cursor.execute(sql)
+        cls._seeded.add(using)
+
+
 @python_2_unicode_compatible
 class CommentFlag(models.Model):
     """
@@ -224,6 +458,14 @@ class CommentFlag(models.Model):
     MODERATOR_DELETION = "moderator deletion"
     MODERATOR_APPROVAL = "moderator approval"
 
+    # The Comment counter maintained for each flag type, on top of the
+    # total ``flag_count``.
+    COUNTER_FIELDS = {
+        SUGGEST_REMOVAL: 'suggest_removal_count',
+        MODERATOR_DELETION: 'moderator_deletion_count',
+        MODERATOR_APPROVAL: 'moderator_approval_count',
+    }
+
     class Meta:
         db_table = 'comments_flags'
         unique_together = [('user', 'comment', 'flag')]
@@ -235,9 +477,114 @@ class CommentFlag(models.Model):
             (self.flag, self.comment_id, self.user.get_username())
 
     def save(self, *args, **kwargs):
+        new = self.pk is None
         if self.flag_date is None:
             self.flag_date = timezone.now()
         super(CommentFlag, self).save(*args, **kwargs)
+        if new:
+            self.update_comment_counters(1)
+
+    def delete(self, *args, **kwargs):
+        super(CommentFlag, self).delete(*args, **kwargs)
+        self.update_comment_counters(-1)
+
+    def update_comment_counters(self, delta):
+        """
+        Atomically add ``delta`` to the flag counters of the flagged comment.
+
+        If the comment instance is cached on this flag its counters are
+        refreshed too, so saving it afterwards doesn't overwrite them.
+        """
+        fields = ['flag_count']
+        if self.flag in self.COUNTER_FIELDS:
+            fields.append(self.COUNTER_FIELDS[self.flag])
+
+        qs = Comment.objects.filter(pk=self.comment_id)
+        if delta > 0:
+            qs.update(**dict((f, models.F(f) + delta) for f in fields))
+        else:
+            # Counters which missed flags, such as those added before they
+            # were kept, stop at 0.
+            for f in fields:
+                qs.filter(**{'%s__gte' % f: -delta}).update(**{f: models.F(f) + delta})
+
+        cache_name = self._meta.get_field('comment').get_cache_name()
+        if hasattr(self, cache_name):
+            comment = getattr(self, cache_name)
+            for f, value in qs.values(*fields)[0].items():
+                setattr(comment, f, value)
+
+
+class CommentFingerprint(models.Model):
+    """
+    One band of the SimHash fingerprint of a comment, used to find
+    near-duplicate comments; see ``comments.fingerprints``. Each comment
+    moderated with ``duplicate_distance`` has one row per band.
+    """
+    comment = models.ForeignKey(Comment, verbose_name=_('comment'), related_name="fingerprints")
+    band_key = models.PositiveIntegerField(_('band key'))
+    fingerprint = models.BigIntegerField(_('fingerprint'))
+    submit_date = models.DateTimeField(_('date/time submitted'))
+
+    objects = CommentFingerprintManager()
+
+    class Meta:
+        db_table = 'comments_fingerprints'
+        index_together = [('band_key', 'submit_date')]
+        verbose_name = _('comment fingerprint')
+        verbose_name_plural = _('comment fingerprints')
+
+
+@python_2_unicode_compatible
+class CommentNotification(models.Model):
+    """
+    An email notification waiting in the outbox. Moderators configured with
+    ``queue_email`` store their notifications here instead of sending them
+    while the comment is being posted; the ``send_comment_notifications``
+    management command delivers them later.
+    """
+    comment = models.ForeignKey(Comment, verbose_name=_('comment'), related_name="notifications",
+                    blank=True, null=True, on_delete=models.SET_NULL)
+    subject = models.CharField(_('subject'), max_length=255)
+    message = models.TextField(_('message'))
+    from_email = models.CharField(_('from'), max_length=255)
+    recipients = models.TextField(_('recipients'))
+    created_date = models.DateTimeField(_('date created'), default=None)
+    sent_date = models.DateTimeField(_('date sent'), blank=True, null=True, db_index=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True)
+
+    # End of the period covered by a digest notification; ``None`` for
+    # notifications about a single comment.
+    digest_until = models.DateTimeField(_('digest until'), blank=True, null=True, db_index=True)
+
+    objects = CommentNotificationManager()
+
+    class Meta:
+        db_table = 'comments_notifications'
+        ordering = ('id',)
+        verbose_name = _('comment notification')
+        verbose_name_plural = _('comment notifications')
+
+    def __str__(self):
+        return "%s to %s" % (self.subject, ", ".join(self.recipient_list))
+
+    def save(self, *args, **kwargs):
+        if self.created_date is None:
+            self.created_date = timezone.now()
+        super(CommentNotification, self).save(*args, **kwargs)
+
+    @property
+    def recipient_list(self):
+        return [r for r in self.recipients.splitlines() if r]
+
+    def get_message(self, connection=None):
+        """
+        Return this notification as an ``EmailMessage`` bound to the given
+        mail connection.
+        """
+        return EmailMessage(self.subject, self.message, self.from_email,
+                            self.recipient_list, connection=connection)
 
 
 class CommentMixin(models.Model):
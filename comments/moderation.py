@@ -57,7 +57,9 @@ class.
 import datetime
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.mail import send_mail
+from django.db.models import Max
 from django.db.models.base import ModelBase
 from django.template import Context, loader
 from django.contrib.sites.models import get_current_site
@@ -65,6 +67,10 @@ from django.utils import timezone
 
 import comments
 from comments import signals
+from comments import spam
+from comments.fingerprints import get_comment_fingerprint
+from comments.models import CommentFingerprint, CommentFlag, CommentNotification
+from comments.ratelimit import rate_limiter
 
 class AlreadyModerated(Exception):
     """
@@ -116,6 +122,27 @@ class CommentModerator(object):
         ``auto_close_field`` after which new comments for an
         object should be disallowed. Default value is ``None``.
 
+    ``duplicate_distance``
+        If this is set to a number of bits, new comments whose
+        SimHash fingerprint is within this distance of a comment
+        posted anywhere on the site in the last
+        ``duplicate_window`` days are considered near-duplicates
+        and will have their ``is_public`` field set to ``False``
+        before saving them. A changed word typically flips 4 to 8
+        bits, unrelated comments differ in 20 or more; 8 is a
+        reasonable value. Default value is ``None``.
+
+    ``duplicate_window``
+        If ``duplicate_distance`` is used, the number of days new
+        comments are compared against. Default value is ``1``.
+
+    ``email_digest``
+        If ``True``, email notifications are not sent for every
+        new comment; instead the ``send_comment_notifications``
+        management command periodically sends site staff a single
+        digest of all new comments. Must be used in conjunction
+        with ``email_notification``. Default value is ``False``.
+
     ``email_notification``
         If ``True``, any new comment on an object of this model
         which survives moderation will generate an email to site
@@ -129,6 +156,24 @@ class CommentModerator(object):
         the object the comment would be attached to. Default value
         is ``None``.
 
+    ``flood_limit``
+        If this is set to a number, each IP address and each
+        authenticated user may post at most this many comments
+        on objects of this model within ``flood_period`` seconds;
+        further comments will be disallowed (immediately
+        deleted). Default value is ``None``.
+
+    ``flood_period``
+        If ``flood_limit`` is used, the length in seconds of the
+        sliding window posts are counted in. Default value is
+        ``60``.
+
+    ``hide_after_flags``
+        If this is set to a number, a public comment will be moved
+        back into moderation (its ``is_public`` field set to
+        ``False``) as soon as it has received this many removal
+        suggestions. Default value is ``None``.
+
     ``moderate_after``
         If ``auto_moderate_field`` is used, this must specify the number
         of days past the value of the field specified by
@@ -136,6 +181,19 @@ class CommentModerator(object):
         object should be marked non-public. Default value is
         ``None``.
 
+    ``spam_threshold``
+        If this is set to a number between 0 and 1, new comments
+        are scored by the spam classifier (see ``comments.spam``)
+        and comments whose spam probability is at least this high
+        will have their ``is_public`` field set to ``False``
+        before saving them. Default value is ``None``.
+
+    ``queue_email``
+        If ``True``, notification emails are stored in the outbox
+        instead of being sent while the comment is posted; run the
+        ``send_comment_notifications`` management command to
+        deliver them. Default value is ``False``.
+
     Most common moderation needs can be covered by changing these
     attributes, but further customization can be obtained by
     subclassing and overriding the following methods. Each method will
@@ -149,6 +207,11 @@ class CommentModerator(object):
         post on the content object, and ``False`` otherwise (in
         which case the comment will be immediately deleted).
 
+    ``flood``
+        Should return ``True`` if the poster is flooding and the
+        comment should be disallowed like with ``allow``, and
+        ``False`` otherwise. Called before ``allow``.
+
     ``email``
         If email notification of the new comment should be sent to
         site staff or moderators, this method is responsible for
@@ -160,6 +223,24 @@ class CommentModerator(object):
         ``False`` before saving), and ``False`` otherwise (in
         which case the ``is_public`` field will not be changed).
 
+    ``spam``
+        Should return ``True`` if the comment is likely spam and
+        should be moderated like with ``moderate``, and ``False``
+        otherwise. Only called for comments ``moderate`` let
+        through.
+
+    ``duplicate``
+        Should return ``True`` if the comment is a near-duplicate
+        of a recent comment and should be moderated like with
+        ``moderate``, and ``False`` otherwise. Only called for
+        comments ``moderate`` and ``spam`` let through.
+
+    ``hide``
+        Called with ``comment`` and ``request`` only, whenever a
+        public comment receives a new removal suggestion. Should
+        return ``True`` if the comment should be moved back into
+        moderation, and ``False`` otherwise.
+
     Subclasses which want to introspect the model for which comments
     are being moderated can do so through the attribute ``_model``,
     which will be the model class.
@@ -168,9 +249,17 @@ class CommentModerator(object):
     auto_close_field = None
     auto_moderate_field = None
     close_after = None
+    duplicate_distance = None
+    duplicate_window = 1
+    email_digest = False
     email_notification = False
     enable_field = None
+    flood_limit = None
+    flood_period = 60
+    hide_after_flags = None
     moderate_after = None
+    spam_threshold = None
+    queue_email = False
 
     def __init__(self, model):
         self._model = model
@@ -213,6 +302,30 @@ class CommentModerator(object):
                 return False
         return True
 
+    def flood(self, comment, content_object, request):
+        """
+        Determine whether the poster of a new comment, identified by
+        IP address and by user, has exceeded ``flood_limit`` comments
+        on objects of this model within ``flood_period`` seconds.
+
+        Return ``True`` if the comment should be disallowed, ``False``
+        otherwise.
+
+        """
+        if self.flood_limit is None:
+            return False
+        scope = '%s.%s' % (self._model._meta.app_label, self._model._meta.object_name.lower())
+        keys = []
+        if comment.ip_address:
+            keys.append('ip:%s:%s' % (scope, comment.ip_address))
+        if comment.user_id:
+            keys.append('user:%s:%s' % (scope, comment.user_id))
+
+        # Count the comment against every key, even if one of them is
+        # already over the limit.
+        results = [rate_limiter.hit(key, self.flood_limit, self.flood_period) for key in keys]
+        return not all(results)
+
     def moderate(self, comment, content_object, request):
         """
         Determine whether a given comment on a given object should be
@@ -229,13 +342,78 @@ class CommentModerator(object):
                 return True
         return False
 
+    def spam(self, comment, content_object, request):
+        """
+        Score a new comment with the spam classifier and determine
+        whether it should be marked non-public as likely spam. The score
+        is stored in the comment's ``spam_score`` field.
+
+        Return ``True`` if the comment is likely spam, ``False``
+        otherwise (or if no classifier has been trained yet).
+
+        """
+        if self.spam_threshold is None:
+            return False
+        classifier = spam.get_classifier()
+        if classifier is None:
+            return False
+        comment.spam_score = classifier.score(spam.get_comment_text(comment))
+        return comment.spam_score >= self.spam_threshold
+
+    def duplicate(self, comment, content_object, request):
+        """
+        Determine whether a new comment is a near-duplicate of a
+        comment posted anywhere on the site in the last
+        ``duplicate_window`` days.
+
+        Return ``True`` if the comment is a near-duplicate, ``False``
+        otherwise.
+
+        """
+        if self.duplicate_distance is None:
+            return False
+        fingerprint = get_comment_fingerprint(comment)
+        if fingerprint is None:
+            return False
+        since = timezone.now() - datetime.timedelta(days=self.duplicate_window)
+        return bool(CommentFingerprint.objects.near_duplicates(
+            fingerprint, since, self.duplicate_distance))
+
+    def hide(self, comment, request):
+        """
+        Determine whether a public comment which has just been suggested
+        for removal should be moved back into moderation.
+
+        This is called on every new removal suggestion, so the content
+        object isn't loaded for it; use ``comment.content_object`` if it's
+        needed.
+
+        Return ``True`` if the comment should be hidden (marked
+        non-public), ``False`` otherwise.
+
+        """
+        if self.hide_after_flags is None:
+            return False
+        count = comment.suggest_removal_count
+        if count >= self.hide_after_flags and comment.moderator_approval_count:
+            # A moderator has approved the comment; only the suggestions
+            # made since the latest approval count.
+            flags = CommentFlag.objects.filter(comment=comment.pk)
+            approved = flags.filter(flag=CommentFlag.MODERATOR_APPROVAL).aggregate(
+                date=Max('flag_date'))['date']
+            count = flags.filter(flag=CommentFlag.SUGGEST_REMOVAL, flag_date__gt=approved).count()
+        return count >= self.hide_after_flags
+
     def email(self, comment, content_object, request):
         """
         Send email notification of a new comment to site staff when email
-        notifications have been requested.
+        notifications have been requested. If ``queue_email`` is set, the
+        notification is stored in the outbox instead. Nothing is sent
+        if ``email_digest`` is set; the comment will be part of the next
+        digest.
 
         """
-        if not self.email_notification:
+        if not self.email_notification or self.email_digest:
             return
         recipient_list = [manager_tuple[1] for manager_tuple in settings.MANAGERS]
         t = loader.get_template('comments/comment_notification_email.txt')
@@ -244,7 +422,11 @@ class CommentModerator(object):
         subject = '[%s] New comment posted on "%s"' % (get_current_site(request).name,
                                                           content_object)
         message = t.render(c)
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list, fail_silently=True)
+        if self.queue_email:
+            CommentNotification.objects.enqueue(subject, message, settings.DEFAULT_FROM_EMAIL,
+                                                recipient_list, comment=comment)
+        else:
+            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list, fail_silently=True)
 
 class Moderator(object):
     """
@@ -275,6 +457,8 @@ class Moderator(object):
     was disallowed (there is currently no way to prevent the comment
     being saved once before removal) and, if the comment is still
     around, will send any notification emails the comment generated.
+    Comments which are later suggested for removal are moderated again
+    when the flag is recorded, and may be hidden.
 
     """
     def __init__(self):
@@ -289,6 +473,7 @@ class Moderator(object):
         """
         signals.comment_will_be_posted.connect(self.pre_save_moderation, sender=comments.get_model())
         signals.comment_was_posted.connect(self.post_save_moderation, sender=comments.get_model())
+        signals.comment_was_flagged.connect(self.flag_moderation, sender=comments.get_model())
 
     def register(self, model_or_iterable, moderation_class):
         """
@@ -335,10 +520,14 @@ class Moderator(object):
         moderation_class = self._registry[model]
 
         # Comment will be disallowed outright (HTTP 403 response)
+        if moderation_class.flood(comment, content_object, request):
+            return False
         if not moderation_class.allow(comment, content_object, request):
             return False
 
-        if moderation_class.moderate(comment, content_object, request):
+        if (moderation_class.moderate(comment, content_object, request) or
+                moderation_class.spam(comment, content_object, request) or
+                moderation_class.duplicate(comment, content_object, request)):
             comment.is_public = False
 
     def post_save_moderation(self, sender, comment, request, **kwargs):
@@ -350,7 +539,32 @@ class Moderator(object):
         model = comment.content_type.model_class()
         if model not in self._registry:
             return
-        self._registry[model].email(comment, comment.content_object, request)
+        moderation_class = self._registry[model]
+
+        # Remember the comment for near-duplicate detection.
+        if moderation_class.duplicate_distance is not None:
+            fingerprint = get_comment_fingerprint(comment)
+            if fingerprint is not None:
+                CommentFingerprint.objects.add(comment, fingerprint)
+
+        moderation_class.email(comment, comment.content_object, request)
+
+    def flag_moderation(self, sender, comment, flag, created, request, **kwargs):
+        """
+        Apply any necessary moderation steps to comments which have
+        just been suggested for removal.
+
+        """
+        if not created or flag.flag != CommentFlag.SUGGEST_REMOVAL or not comment.is_public:
+            return
+        model = ContentType.objects.get_for_id(comment.content_type_id).model_class()
+        if model not in self._registry:
+            return
+        if self._registry[model].hide(comment, request):
+            comment.is_public = False
+            sender._default_manager.filter(pk=comment.pk).update(is_public=False)
+            signals.comment_threads_were_changed.send(sender=sender, tree_ids=[comment.tree_id],
+                                                      using=sender._default_manager.db)
 
 # Import this instance in your own code to use in registering
 # your models for moderation.
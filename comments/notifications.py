@@ -0,0 +1,141 @@
+"""
+Delivery of queued comment notifications.
+
+Notifications stored in the outbox (see ``CommentModerator.queue_email``) are
+sent from here, usually by the ``send_comment_notifications`` management
+command, so that posting a comment never waits on the mail server. Digests
+for moderators with ``email_digest`` enabled are built here as well.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.mail import get_connection
+from django.db.models import F, Max
+from django.template import Context, loader
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_ATTEMPTS = 3
+COMMENTS_EMAIL_DIGEST_INTERVAL = getattr(settings, 'COMMENTS_EMAIL_DIGEST_INTERVAL', 60 * 60)
+
+
+def queue_digest_notifications(now=None):
+    """
+    Queue a digest of the comments posted since the previous digest on all
+    models whose moderator has ``email_digest`` enabled.
+
+    Nothing is queued until ``COMMENTS_EMAIL_DIGEST_INTERVAL`` seconds have
+    passed since the previous digest. The comments for the period are loaded
+    with a single query and rendered once; one notification is queued per
+    recipient.
+
+    Returns the number of queued notifications.
+    """
+    import comments
+    from comments.models import CommentNotification
+    from comments.moderation import moderator
+
+    content_types = [ContentType.objects.get_for_model(model)
+                     for model, moderation_class in moderator._registry.items()
+                     if moderation_class.email_notification and moderation_class.email_digest]
+    if not content_types:
+        return 0
+
+    if now is None:
+        now = timezone.now()
+    interval = datetime.timedelta(seconds=COMMENTS_EMAIL_DIGEST_INTERVAL)
+    since = CommentNotification.objects.filter(
+        digest_until__isnull=False
+    ).aggregate(since=Max('digest_until'))['since']
+    if since is None:
+        since = now - interval
+    elif now - since < interval:
+        return 0
+
+    comment_list = list(comments.get_model().objects.filter(
+        content_type__in = content_types,
+        submit_date__gt = since,
+        submit_date__lte = now,
+        is_removed = False,
+    ).select_related('user').prefetch_related('content_object').order_by('submit_date'))
+    if not comment_list:
+        return 0
+
+    recipient_list = [manager_tuple[1] for manager_tuple in settings.MANAGERS]
+    t = loader.get_template('comments/comment_digest_email.txt')
+    c = Context({ 'comment_list': comment_list,
+                  'since': since,
+                  'until': now })
+    subject = '[%s] %d new comment(s) posted' % (Site.objects.get_current().name,
+                                                 len(comment_list))
+    message = t.render(c)
+    for recipient in recipient_list:
+        CommentNotification.objects.enqueue(subject, message, settings.DEFAULT_FROM_EMAIL,
+                                            [recipient], digest_until=now)
+    return len(recipient_list)
+
+
+def send_queued_notifications(batch_size=NOTIFICATION_BATCH_SIZE,
+                              max_attempts=NOTIFICATION_MAX_ATTEMPTS,
+                              connection=None):
+    """
+    Drain the outbox in batches of ``batch_size`` over a single mail
+    connection.
+
+    Each notification is claimed by setting its ``sent_date`` before it's
+    sent, so workers draining the outbox at the same time don't send it
+    twice; one which fails to send is put back, and retried on the next run
+    until it has been attempted ``max_attempts`` times.
+
+    Returns a ``(sent, failed)`` tuple.
+    """
+    from comments.models import CommentNotification
+
+    if connection is None:
+        connection = get_connection()
+
+    sent = failed = 0
+    last_pk = 0
+    opened = connection.open()
+    try:
+        while True:
+            batch = list(CommentNotification.objects.pending(max_attempts)
+                         .filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            delivered = []
+            for notification in batch:
+                claimed = CommentNotification.objects.filter(
+                    pk=notification.pk, sent_date__isnull=True).update(sent_date=timezone.now())
+                if not claimed:
+                    # Another worker got to it first.
+                    continue
+                try:
+                    notification.get_message(connection).send()
+                except Exception as e:
+                    CommentNotification.objects.filter(pk=notification.pk).update(
+                        attempts = F('attempts') + 1,
+                        last_error = force_text(e),
+                        sent_date = None,
+                    )
+                    failed += 1
+                else:
+                    delivered.append(notification.pk)
+
+            if delivered:
+                CommentNotification.objects.filter(pk__in=delivered).update(
+                    attempts = F('attempts') + 1,
+                    sent_date = timezone.now(),
+                )
+                sent += len(delivered)
+    finally:
+        if opened:
+            connection.close()
+
+    return sent, failed
@@ -0,0 +1,100 @@
+"""
+Saving new comments safely under concurrent posting.
+
+Inserting a reply shifts the ``lft``/``rght`` values of its thread, computed
+from the parent's values; two replies saved concurrently into one thread
+would both compute their place from the same, soon stale, values. Replies
+are therefore saved in a transaction holding a row lock on the root of
+their thread, which serializes posting within a thread while threads on
+other comments proceed in parallel. Databases without row locks (SQLite)
+take their write lock instead, with an update of the root which changes
+nothing. Root comments start a thread of their own and need no lock.
+
+Transactions aborted by the database (deadlocks, serialization failures,
+SQLite's "database is locked") are retried a few times; other database
+errors are raised at once.
+"""
+
+from django.db import connections, router, transaction, DatabaseError
+from django.utils.encoding import force_text
+
+COMMENT_SAVE_RETRIES = 3
+
+# How the databases report a transaction aborted to resolve a conflict with
+# another one: PostgreSQL's SQLSTATEs (serialization_failure and
+# deadlock_detected), MySQL's error codes (lock wait timeout and deadlock),
+# and, for backends re-raising errors without them, their messages.
+ABORTED_PGCODES = ('40001', '40P01')
+ABORTED_MYSQL_CODES = (1205, 1213)
+ABORTED_MESSAGES = ('database is locked', 'deadlock detected', 'could not serialize access',
+                    'Deadlock found', 'Lock wait timeout exceeded')
+
+# Django 1.6 nests atomic blocks; Django 1.5 only has commit_on_success.
+atomic = getattr(transaction, 'atomic', transaction.commit_on_success)
+
+
+def lock_tree(comment, using):
+    """
+    Lock the root of the thread ``comment`` is going to be inserted into,
+    and reload its parent so its tree fields are current.
+    """
+    manager = comment.__class__._default_manager.using(using)
+    opts = comment._mptt_meta
+    tree_id = manager.filter(pk=comment.parent_id).values_list(opts.tree_id_attr, flat=True).get()
+    root = manager.filter(**{
+        opts.tree_id_attr: tree_id,
+        '%s__isnull' % opts.parent_attr: True,
+    })
+    if connections[using].features.has_select_for_update:
+        list(root.select_for_update().values_list('pk', flat=True))
+    else:
+        root.update(**{opts.tree_id_attr: tree_id})
+    # The thread can't change any more; read the parent's place in it again.
+    comment.parent = manager.get(pk=comment.parent_id)
+
+
+def is_aborted(error):
+    """
+    Return whether a database error reports the transaction being aborted
+    over a conflict with another one, which trying again may resolve.
+    """
+    # Django 1.6 keeps the driver's error as the cause of its own.
+    for e in (error, getattr(error, '__cause__', None)):
+        if e is None:
+            continue
+        if getattr(e, 'pgcode', None) in ABORTED_PGCODES:
+            return True
+        if e.args and e.args[0] in ABORTED_MYSQL_CODES:
+            return True
+        message = force_text(e, errors='replace')
+        if any(m in message for m in ABORTED_MESSAGES):
+            return True
+    return False
+
+
+def save_comment(comment, retries=COMMENT_SAVE_RETRIES, using=None):
+    """
+    Save ``comment``, locking its thread if it's a new reply, and retry up
+    to ``retries`` times if the database aborts the transaction.
+    """
+    using = using or router.db_for_write(comment.__class__, instance=comment)
+    opts = comment._mptt_meta
+    new = comment.pk is None
+    attempt = 0
+    while True:
+        try:
+            with atomic(using=using):
+                if new and comment.parent_id is not None:
+                    lock_tree(comment, using)
+                comment.save(using=using)
+            return comment
+        except DatabaseError as e:
+            attempt += 1
+            if attempt > retries or not is_aborted(e):
+                raise
+            if new:
+                # Let the next attempt find the comment's place again.
+                comment.pk = None
+                for attr in (opts.tree_id_attr, opts.left_attr,
+                             opts.right_attr, opts.level_attr):
+                    setattr(comment, attr, None)
@@ -0,0 +1,114 @@
+"""
+Posting rate limits for flood control.
+
+Counters are kept in the cache named by ``COMMENTS_RATE_LIMIT_CACHE`` so all
+processes share them. If that cache doesn't store anything (the dummy
+backend) or is unavailable, counters are kept in process memory instead.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.dummy import DummyCache
+
+COMMENTS_RATE_LIMIT_CACHE = getattr(settings, 'COMMENTS_RATE_LIMIT_CACHE', 'default')
+
+
+class LocalCounterStore(object):
+    """
+    In-process counters with expiry, for when no shared cache is available.
+    """
+    # Expired counters are purged once the store grows past this size.
+    max_entries = 10000
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def incr(self, key, timeout):
+        now = time.time()
+        with self._lock:
+            if len(self._counters) > self.max_entries:
+                self._counters = dict((k, v) for k, v in self._counters.items() if v[1] > now)
+            value, expires = self._counters.get(key, (0, 0))
+            if expires <= now:
+                value, expires = 0, now + timeout
+            self._counters[key] = (value + 1, expires)
+            return value + 1
+
+    def get(self, key):
+        value, expires = self._counters.get(key, (0, 0))
+        if expires <= time.time():
+            return 0
+        return value
+
+
+class CacheCounterStore(object):
+    """
+    Counters shared through a Django cache, using its atomic ``incr``.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def incr(self, key, timeout):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # The counter expired between add() and incr().
+            self.cache.set(key, 1, timeout)
+            return 1
+
+    def get(self, key):
+        return self.cache.get(key, 0)
+
+
+class SlidingWindowRateLimiter(object):
+    """
+    Allows ``limit`` hits per ``period`` seconds for each key.
+
+    The window slides: hits in the previous fixed period are weighted by how
+    much of it still overlaps the window, which avoids admitting twice the
+    limit around period boundaries while needing only two counters per key.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.fallback = LocalCounterStore()
+
+    def get_store(self):
+        if self.store is None:
+            cache = get_cache(COMMENTS_RATE_LIMIT_CACHE)
+            if isinstance(cache, DummyCache):
+                self.store = self.fallback
+            else:
+                self.store = CacheCounterStore(cache)
+        return self.store
+
+    def hit(self, key, limit, period, now=None):
+        """
+        Record a hit for ``key`` and return ``True`` if it's within the
+        limit, ``False`` if the key is flooding. Rejected hits count
+        towards the limit as well.
+        """
+        if now is None:
+            now = time.time()
+        bucket = int(now // period)
+        elapsed = (now % period) / float(period)
+        current_key = 'comments:ratelimit:%s:%d:%d' % (key, period, bucket)
+        previous_key = 'comments:ratelimit:%s:%d:%d' % (key, period, bucket - 1)
+
+        store = self.get_store()
+        try:
+            current = store.incr(current_key, period * 2)
+            previous = store.get(previous_key)
+        except Exception:
+            # The shared cache is unavailable; count in this process.
+            current = self.fallback.incr(current_key, period * 2)
+            previous = self.fallback.get(previous_key)
+        return previous * (1 - elapsed) + current <= limit
+
+rate_limiter = SlidingWindowRateLimiter()
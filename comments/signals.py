@@ -19,3 +19,9 @@ comment_was_posted = Signal(providing_args=["comment", "request"])
 # was a user requesting removal of a comment, a moderator approving/removing a
 # comment, or some other custom user flag.
 comment_was_flagged = Signal(providing_args=["comment", "flag", "created", "request"])
+
+# Sent after comments were changed with queryset updates, which don't send
+# the post-save signal, by bulk operations such as
+# comments.bulk.anonymize_comments and by moderators hiding comments. Caches
+# of the threads with the given tree ids should be dropped.
+comment_threads_were_changed = Signal(providing_args=["tree_ids", "using"])
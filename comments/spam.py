@@ -0,0 +1,168 @@
+"""
+In-process spam scoring for comments.
+
+The default classifier is a multinomial naive Bayes model over hashed token
+features, trained from the comments site staff have already judged: public
+comments count as ham, removed comments as spam. It is trained with the
+``train_spam_classifier`` management command, which stores the model in the
+file named by ``COMMENTS_SPAM_MODEL``, and used by moderators with a
+``spam_threshold`` (see ``comments.moderation``).
+
+Another classifier can be plugged in through ``COMMENTS_SPAM_CLASSIFIER``; it
+has to provide the ``train``, ``score``, ``score_many``, ``save`` and
+``load`` methods of ``NaiveBayesSpamClassifier``.
+"""
+
+import json
+import math
+import os
+import re
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes
+from django.utils.importlib import import_module
+
+COMMENTS_SPAM_CLASSIFIER = getattr(settings, 'COMMENTS_SPAM_CLASSIFIER',
+                                   'comments.spam.NaiveBayesSpamClassifier')
+COMMENTS_SPAM_MODEL = getattr(settings, 'COMMENTS_SPAM_MODEL', None)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# The comment fields the classifier looks at.
+TEXT_FIELDS = ('title', 'comment', 'user_name', 'user_url')
+
+
+def get_comment_text(comment):
+    """
+    Return the text of a comment the classifier looks at.
+    """
+    return ' '.join(getattr(comment, f) for f in TEXT_FIELDS)
+
+
+def hash_features(text, n_features):
+    """
+    Return the hashed token features of ``text`` as a list of bucket
+    numbers. A stable hash is used so models can be shared between
+    processes.
+    """
+    return [(zlib.crc32(force_bytes(token)) & 0xffffffff) % n_features
+            for token in TOKEN_RE.findall(text.lower())]
+
+
+class NaiveBayesSpamClassifier(object):
+    """
+    Multinomial naive Bayes over ``n_features`` hashed token buckets.
+    """
+
+    def __init__(self, n_features=2 ** 18):
+        self.n_features = n_features
+        self.doc_counts = {'ham': 0, 'spam': 0}
+        self.token_counts = {'ham': {}, 'spam': {}}
+        self._weights = None
+
+    def train(self, texts, is_spam):
+        """
+        Add ``texts``, all spam or all ham, to the model.
+        """
+        label = is_spam and 'spam' or 'ham'
+        counts = self.token_counts[label]
+        for text in texts:
+            self.doc_counts[label] += 1
+            for feature in hash_features(text, self.n_features):
+                counts[feature] = counts.get(feature, 0) + 1
+        self._weights = None
+
+    def _get_weights(self):
+        """
+        Compute the log-likelihood ratio of every seen bucket once, so
+        scoring a comment is a sum of table lookups.
+        """
+        if self._weights is None:
+            ham, spam = self.token_counts['ham'], self.token_counts['spam']
+            ham_total = sum(ham.values()) + self.n_features
+            spam_total = sum(spam.values()) + self.n_features
+            weights = {}
+            for feature in set(ham) | set(spam):
+                weights[feature] = (math.log((spam.get(feature, 0) + 1.0) / spam_total) -
+                                    math.log((ham.get(feature, 0) + 1.0) / ham_total))
+            default = math.log(1.0 / spam_total) - math.log(1.0 / ham_total)
+            prior = (math.log(self.doc_counts['spam'] + 1.0) -
+                     math.log(self.doc_counts['ham'] + 1.0))
+            self._weights = (weights, default, prior)
+        return self._weights
+
+    def score(self, text):
+        """
+        Return the probability (0 to 1) that ``text`` is spam.
+        """
+        return self.score_many([text])[0]
+
+    def score_many(self, texts):
+        """
+        Return the spam probabilities of all ``texts``, sharing the weight
+        table between them.
+        """
+        weights, default, prior = self._get_weights()
+        scores = []
+        for text in texts:
+            log_odds = prior
+            for feature in hash_features(text, self.n_features):
+                log_odds += weights.get(feature, default)
+            # Numerically safe logistic function.
+            if log_odds >= 0:
+                scores.append(1.0 / (1.0 + math.exp(-log_odds)))
+            else:
+                odds = math.exp(log_odds)
+                scores.append(odds / (1.0 + odds))
+        return scores
+
+    def save(self, path):
+        data = {
+            'n_features': self.n_features,
+            'doc_counts': self.doc_counts,
+            'token_counts': dict((label, list(counts.items()))
+                                 for label, counts in self.token_counts.items()),
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        classifier = cls(n_features=data['n_features'])
+        classifier.doc_counts = data['doc_counts']
+        classifier.token_counts = dict((label, dict(counts))
+                                       for label, counts in data['token_counts'].items())
+        return classifier
+
+
+def get_classifier_class():
+    """
+    Return the classifier class named by ``COMMENTS_SPAM_CLASSIFIER``.
+    """
+    module_name, class_name = COMMENTS_SPAM_CLASSIFIER.rsplit('.', 1)
+    try:
+        return getattr(import_module(module_name), class_name)
+    except (ImportError, AttributeError) as e:
+        raise ImproperlyConfigured("The COMMENTS_SPAM_CLASSIFIER setting refers to "
+                                   "a non-existing class. (%s)" % e)
+
+_classifier_cache = {}
+
+def get_classifier(path=None):
+    """
+    Return the trained classifier stored in ``path`` (``COMMENTS_SPAM_MODEL``
+    by default), or ``None`` if no model has been trained yet. The model is
+    loaded once per process and reloaded when the file changes.
+    """
+    path = path or COMMENTS_SPAM_MODEL
+    if not path or not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    if _classifier_cache.get('key') != key:
+        _classifier_cache['classifier'] = get_classifier_class().load(path)
+        _classifier_cache['key'] = key
+    return _classifier_cache['classifier']
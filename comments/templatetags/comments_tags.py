@@ -4,14 +4,14 @@ from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.http import HttpResponse, Http404
 from django.template import RequestContext
-from django.utils.encoding import smart_text
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 
 
 import comments
 from comments.views.list import list_comments
-from comments import utils
+from comments import archive, utils
+from comments.managers import object_pk_lookup
 
 register = template.Library()
 
@@ -82,17 +82,18 @@ class BaseCommentNode(template.Node):
         if not object_pk:
             return self.comment_model.objects.none()
 
-        qs = self.comment_model.objects.filter(
+        comment_model = archive.get_comment_model_for(ctype, object_pk)
+        qs = comment_model.objects.filter(
             content_type = ctype,
-            object_pk    = smart_text(object_pk),
             site__pk     = settings.SITE_ID,
+            **object_pk_lookup(comment_model, object_pk)
         )
 
         # The is_public and is_removed fields are implementation details of the
         # built-in comment model's spam filtering system, so they might not
         # be present on a custom comment model subclass. If they exist, we
         # should filter on them.
-        field_names = [f.name for f in self.comment_model._meta.fields]
+        field_names = [f.name for f in comment_model._meta.fields]
         if 'is_public' in field_names:
             qs = qs.filter(is_public=True)
         if getattr(settings, 'COMMENTS_HIDE_REMOVED', True) and 'is_removed' in field_names:
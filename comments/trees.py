@@ -0,0 +1,136 @@
+"""
+Checking and repairing the nested set fields of comment threads.
+
+Each thread (tree id) is checked and renumbered on its own, so a corrupted
+thread can be repaired without mptt's full table ``rebuild()``, and many
+threads can be processed in parallel (see the ``check_comment_trees``
+management command).
+"""
+
+from comments.posting import atomic
+
+
+TREE_FIELDS = ('parent', 'tree_id', 'lft', 'rght', 'level', 'submit_date')
+
+
+def number_thread(root, replies, opts, tree_id=None):
+    """
+    Set the tree fields of the thread starting at ``root``, where
+    ``replies`` maps the primary key of each comment to its replies.
+    Replies are ordered by date, like mptt inserts them. Returns the
+    comments of the thread in tree order.
+    """
+    if tree_id is None:
+        tree_id = getattr(root, opts.tree_id_attr)
+    ordered = []
+    counter = 1
+    # Depth-first, numbering lft on the way down and rght on the way back up.
+    stack = [(root, 0, False)]
+    while stack:
+        node, level, done = stack.pop()
+        if done:
+            setattr(node, opts.right_attr, counter)
+            counter += 1
+            continue
+        ordered.append(node)
+        setattr(node, opts.tree_id_attr, tree_id)
+        setattr(node, opts.left_attr, counter)
+        setattr(node, opts.level_attr, level)
+        counter += 1
+        stack.append((node, level, True))
+        children = sorted(replies.get(node.pk, []), key=lambda c: (c.submit_date, c.pk))
+        for child in reversed(children):
+            stack.append((child, level + 1, False))
+    return ordered
+
+
+def check_thread(nodes, opts):
+    """
+    Return ``True`` if the tree fields of ``nodes``, the comments of one
+    tree id, form a valid nested set matching their parents.
+    """
+    left, right, level = opts.left_attr, opts.right_attr, opts.level_attr
+    parent = opts.parent_attr + '_id'
+    nodes = sorted(nodes, key=lambda n: getattr(n, left))
+    bounds = sorted([getattr(n, left) for n in nodes] + [getattr(n, right) for n in nodes])
+    if bounds != list(range(1, 2 * len(nodes) + 1)):
+        return False
+
+    open_nodes = []
+    for node in nodes:
+        while open_nodes and getattr(open_nodes[-1], right) < getattr(node, left):
+            open_nodes.pop()
+        if not open_nodes and node is not nodes[0]:
+            # A second root.
+            return False
+        container = open_nodes and open_nodes[-1].pk or None
+        if getattr(node, parent) != container or getattr(node, level) != len(open_nodes):
+            return False
+        if getattr(node, right) < getattr(node, left) or (
+                open_nodes and getattr(node, right) > getattr(open_nodes[-1], right)):
+            return False
+        open_nodes.append(node)
+    return True
+
+
+def repair_thread(model, tree_id, using='default'):
+    """
+    Renumber the comments of one tree id from their parents, saving only the
+    comments whose fields change. The root of the thread is locked while it
+    is repaired, as when posting (see ``comments.posting``). Returns
+    ``False`` if the thread can't be repaired on its own: it doesn't have a
+    single root, or has replies to comments in other threads.
+    """
+    opts = model._mptt_meta
+    parent = opts.parent_attr + '_id'
+    manager = model._default_manager.using(using)
+    qs = manager.filter(**{opts.tree_id_attr: tree_id})
+    with atomic(using=using):
+        list(qs.select_for_update().filter(**{'%s__isnull' % opts.parent_attr: True})
+             .values_list('pk', flat=True))
+        nodes = list(qs.only(*TREE_FIELDS))
+        roots = [n for n in nodes if getattr(n, parent) is None]
+        if len(roots) != 1:
+            return False
+        before = dict((n.pk, (getattr(n, opts.left_attr), getattr(n, opts.right_attr),
+                              getattr(n, opts.level_attr))) for n in nodes)
+        replies = {}
+        for node in nodes:
+            replies.setdefault(getattr(node, parent), []).append(node)
+        ordered = number_thread(roots[0], replies, opts)
+        if len(ordered) != len(nodes):
+            return False
+
+        for node in ordered:
+            after = (getattr(node, opts.left_attr), getattr(node, opts.right_attr),
+                     getattr(node, opts.level_attr))
+            if after != before[node.pk]:
+                manager.filter(pk=node.pk).update(**{
+                    opts.left_attr: after[0],
+                    opts.right_attr: after[1],
+                    opts.level_attr: after[2],
+                })
+    return True
+
+
+def check_trees(model, tree_ids, repair=False, using='default'):
+    """
+    Check the threads with the given tree ids, repairing the broken ones if
+    ``repair`` is true. Returns a ``(broken, repaired)`` tuple of tree id
+    lists.
+    """
+    opts = model._mptt_meta
+    threads = {}
+    qs = model._default_manager.using(using).filter(**{
+        '%s__in' % opts.tree_id_attr: tree_ids
+    }).only(*TREE_FIELDS).order_by()
+    for node in qs.iterator():
+        threads.setdefault(getattr(node, opts.tree_id_attr), []).append(node)
+
+    broken, repaired = [], []
+    for tree_id in sorted(threads):
+        if not check_thread(threads[tree_id], opts):
+            broken.append(tree_id)
+            if repair and repair_thread(model, tree_id, using):
+                repaired.append(tree_id)
+    return broken, repaired
@@ -14,6 +14,8 @@ urlpatterns = patterns('comments.views',
     url(r'^deleted/$',                  'moderation.delete_done',       name='comments-delete-done'),
     url(r'^approve/(\d+)/$',            'moderation.approve',           name='comments-approve'),
     url(r'^approved/$',                 'moderation.approve_done',      name='comments-approve-done'),
+    url(r'^moderation/$',               'moderation.queue',             name='comments-moderation-queue'),
+    url(r'^user/(\d+)/$',               'list.user_comments',           name='comments-user-comments'),
 )
 
 urlpatterns += patterns('',
@@ -8,11 +8,13 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
-from django.utils.encoding import smart_text, force_text
+from django.utils.encoding import force_text
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from url_tools.helper import UrlHelper
 
+from comments import archive
+from comments.managers import object_pk_lookup
 from comments.sorters import CommentSorter
 
 COMMENTS_PER_PAGE = getattr(settings, 'COMMENTS_PER_PAGE', 10)
@@ -30,7 +32,7 @@ class CommentPostBadRequest(http.HttpResponseBadRequest):
             self.content = render_to_string("comments/400-debug.html", {"why": why})
 
 
-def get_query_set(ctype=None, object_pk=None, target=None, root_only=False, except_root=False, tree_ids=None):
+def get_query_set(ctype=None, object_pk=None, target=None, root_only=False, except_root=False, tree_ids=None, model=None):
 
     if target:
         ctype = ContentType.objects.get_for_model(target)
@@ -39,21 +41,22 @@ def get_query_set(ctype=None, object_pk=None, target=None, root_only=False, exce
     if ctype is None or object_pk is None:
         raise Exception('No ctype or object_pk supplied')
 
-    import comments
-    COMMENT_MODEL = comments.get_model()
+    # Comments on archived objects are read from the archive, unless the
+    # caller already knows where they are.
+    COMMENT_MODEL = model or archive.get_comment_model_for(ctype, object_pk)
 
     qs = COMMENT_MODEL.objects.filter(
         content_type=ctype,
-        object_pk=smart_text(object_pk),
         site__pk=settings.SITE_ID,
+        **object_pk_lookup(COMMENT_MODEL, object_pk)
     )
 
     # Only return the root level items?
     if root_only:
-        qs = qs.exclude(parent__isnull=False)
+        qs = qs.filter(parent__isnull=True)
 
     if except_root:
-        qs = qs.exclude(parent__isnull=True)
+        qs = qs.filter(parent__isnull=False)
 
     # Get tree ids.
     if tree_ids:
@@ -95,7 +98,9 @@ def get_root_children(root_qs, ctype, object_pk):
             tree_ids.append(obj.tree_id)
 
     if tree_ids:
-        return get_query_set(ctype=ctype, object_pk=object_pk, tree_ids=tree_ids, except_root=True)
+        # The replies are in the same table as their roots.
+        return get_query_set(ctype=ctype, object_pk=object_pk, tree_ids=tree_ids,
+                             except_root=True, model=obj.__class__)
 
     return None
 
@@ -187,16 +192,32 @@ def get_comment_page(target, comment, request=None):
     return None
 
 
-def get_comment_url(comment_pk=None, comment=None, request=None, include_anchor=True):
+def get_comment(comment_pk):
+    """
+    Return the comment with the primary key ``comment_pk``, looking it up in
+    the archive if it was archived, or raise ``Http404``.
+    """
+    import comments
+    COMMENT_MODEL = comments.get_model()
+    try:
+        return COMMENT_MODEL.objects.get(pk=comment_pk, site__pk=settings.SITE_ID)
+    except COMMENT_MODEL.DoesNotExist:
+        from comments.models import ArchivedComment, Comment
+        if COMMENT_MODEL is not Comment:
+            raise http.Http404('No comment %r.' % comment_pk)
+        return get_object_or_404(ArchivedComment, pk=comment_pk, site__pk=settings.SITE_ID)
+
+
+def get_comment_url(comment_pk=None, comment=None, request=None, include_anchor=True, target=None):
     if comment_pk:
-        import comments
-        comment = get_object_or_404(comments.get_model(), pk=comment_pk, site__pk=settings.SITE_ID)
+        comment = get_comment(comment_pk)
 
     if comment is None:
         raise Exception('No comment supplied')
 
     top_level = get_top_level_comment(comment)
-    target = top_level.content_object
+    if target is None:
+        target = top_level.content_object
     page = get_comment_page(target=target, comment=top_level, request=request)
 
     if target and isinstance(page, int):
@@ -217,8 +238,7 @@ def get_comment_url(comment_pk=None, comment=None, request=None, include_anchor=
 
 def get_parent_url(comment=None, comment_pk=None, request=None):
     if comment_pk:
-        import comments
-        comment = get_object_or_404(comments.get_model(), pk=comment_pk, site__pk=settings.SITE_ID)
+        comment = get_comment(comment_pk)
 
     if comment is None:
         raise Exception('No comment supplied')
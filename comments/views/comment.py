@@ -97,9 +97,13 @@ def edit(request, comment_pk=None, parent_pk=None, content_type=None, object_pk=
         if form.is_valid():
             # Save the comment and signal that it was saved
             result = form.save()
+            if isinstance(result, HttpResponse):
+                # A comment_will_be_posted receiver killed the comment.
+                return result
+
             # Get comment url
             if not next:
-                next = utils.get_comment_url(comment_pk=result._get_pk_val(), request=request)
+                next = utils.get_comment_url(comment=result, request=request, target=form.target_object)
             return next_redirect(request, fallback=next)
             #_get_pk_val()
         else:
@@ -5,7 +5,8 @@ from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.shortcuts import render_to_response, render
+from django.contrib.auth import get_user_model
+from django.shortcuts import get_object_or_404, render_to_response, render
 from django.template import RequestContext
 from django.template.response import TemplateResponse
 from django.template.loader import render_to_string
@@ -110,3 +111,48 @@ def list_comments(request, ctype=None, object_pk=None, target=None, root_only=Tr
 
     else:
         return HttpResponse('')
+
+
+def user_comments(request, user_pk):
+    """
+    List the public comments of a user on the current site, the newest
+    first.
+
+    Pages are addressed by the primary key of the last comment on the
+    previous page (``?after=<pk>``) rather than by page number.
+
+    Templates: :template:`comments/user_comments.html`,
+    Context:
+        comment_user
+            the user
+        comment_list
+            the comments on this page
+        next_after
+            the ``after`` value for the next page, or ``None`` on the last
+            page
+    """
+    user = get_object_or_404(get_user_model(), pk=user_pk)
+    after = request.GET.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            raise Http404
+
+    try:
+        qs = COMMENT_MODEL.objects.for_user(user, after=after)
+    except COMMENT_MODEL.DoesNotExist:
+        raise Http404
+
+    # Fetch one extra row to find out whether there is a next page.
+    comment_list = COMMENT_MODEL.objects.prefetch_content_objects(qs[:COMMENTS_PER_PAGE + 1])
+    next_after = None
+    if len(comment_list) > COMMENTS_PER_PAGE:
+        comment_list = comment_list[:COMMENTS_PER_PAGE]
+        next_after = comment_list[-1].pk
+
+    return TemplateResponse(request, 'comments/user_comments.html', {
+        'comment_user': user,
+        'comment_list': comment_list,
+        'next_after': next_after,
+    })
@@ -3,7 +3,10 @@ from __future__ import absolute_import
 from django import template
 from django.conf import settings
 from django.contrib.auth.decorators import login_required, permission_required
+from django.http import Http404
 from django.shortcuts import get_object_or_404, render_to_response
+from django.template.response import TemplateResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_protect
 
 import comments
@@ -11,6 +14,8 @@ from comments import signals
 from comments import utils
 from comments.views.utils import next_redirect, confirmation_view
 
+COMMENTS_MODERATION_QUEUE_PER_PAGE = getattr(settings, 'COMMENTS_MODERATION_QUEUE_PER_PAGE', 50)
+
 @csrf_protect
 @login_required
 def flag(request, comment_id, next=None):
@@ -102,6 +107,50 @@ def approve(request, comment_id, next=None):
             template.RequestContext(request)
         )
 
+@permission_required("comments.can_moderate")
+def queue(request):
+    """
+    List the comments awaiting moderation, those with the most removal
+    suggestions and the oldest first.
+    Requires the "can moderate comments" permission.
+
+    Pages are addressed by the primary key of the last comment on the
+    previous page (``?after=<pk>``) rather than by page number.
+
+    Templates: :template:`comments/moderation_queue.html`,
+    Context:
+        comment_list
+            the comments on this page
+        next_after
+            the ``after`` value for the next page, or ``None`` on the last
+            page
+    """
+    after = request.GET.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            raise Http404
+
+    try:
+        qs = comments.get_model().objects.moderation_queue(after=after)
+    except comments.get_model().DoesNotExist:
+        raise Http404
+
+    qs = qs.filter(site__pk=settings.SITE_ID).select_related('user', 'content_type')
+
+    # Fetch one extra row to find out whether there is a next page.
+    comment_list = qs.model.objects.prefetch_content_objects(qs[:COMMENTS_MODERATION_QUEUE_PER_PAGE + 1])
+    next_after = None
+    if len(comment_list) > COMMENTS_MODERATION_QUEUE_PER_PAGE:
+        comment_list = comment_list[:COMMENTS_MODERATION_QUEUE_PER_PAGE]
+        next_after = comment_list[-1].pk
+
+    return TemplateResponse(request, 'comments/moderation_queue.html', {
+        'comment_list': comment_list,
+        'next_after': next_after,
+    })
+
 # The following functions actually perform the various flag/aprove/delete
 # actions. They've been broken out into separate functions to that they
 # may be called from admin actions.
@@ -146,6 +195,11 @@ def perform_approve(request, comment):
         user    = request.user,
         flag    = comments.models.CommentFlag.MODERATOR_APPROVAL,
     )
+    if not created:
+        # Approving again restarts the count of removal suggestions which
+        # hide the comment; see CommentModerator.hide.
+        flag.flag_date = timezone.now()
+        flag.save()
 
     comment.is_removed = False
     comment.is_public = True
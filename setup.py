@@ -36,5 +36,5 @@ setup(
     packages=find_packages(exclude=['tests']),
     include_package_data=True,
     test_suite='tests.runtests.main',
-    install_requires=['Django>=1.5']
+    install_requires=['Django>=1.5', 'django-mptt>=0.6,<0.7']
 )
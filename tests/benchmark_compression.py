@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Compares the codecs of ``comments.compression``: the storage saved on the
+archived comment texts against the time taken to decompress them as they're
+read.
+
+Reads the comments of a file written by the ``export_comments`` command
+(optionally gzipped), or uses generated comments when none is given::
+
+    python tests/benchmark_compression.py [comments.jsonl[.gz]]
+"""
+
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from django.conf import settings
+settings.configure()
+
+from comments.compression import CODECS, compress_text, decompress_text
+
+WORDS = ("the comment thread reply post article great point agree disagree "
+         "however think really would could should also because which people "
+         "time years first never always something nothing").split()
+
+
+def generated_texts(count=5000, seed=0):
+    rnd = random.Random(seed)
+    for i in range(count):
+        # Mostly short comments, with a long tail.
+        length = int(rnd.paretovariate(1.2) * 12)
+        yield u' '.join(rnd.choice(WORDS) for _ in range(length)).capitalize() + u'.'
+
+
+def exported_texts(path):
+    opener = gzip.open if path.endswith('.gz') else io.open
+    with opener(path, 'rb') as f:
+        for line in f:
+            record = json.loads(line.decode('utf-8'))
+            yield record.get('title') or u''
+            yield record.get('comment') or u''
+
+
+def main():
+    if len(sys.argv) > 1:
+        texts = list(exported_texts(sys.argv[1]))
+    else:
+        texts = list(generated_texts())
+    raw = sum(len(t.encode('utf-8')) for t in texts)
+    print("%d texts, %d bytes" % (len(texts), raw))
+    print("%-6s %12s %8s %10s %16s" % ("codec", "stored", "ratio", "compressed", "decode (us/text)"))
+
+    for codec in sorted(CODECS):
+        stored = [compress_text(t, codec) for t in texts]
+        size = sum(len(s.encode('utf-8')) for s in stored)
+        compressed = sum(1 for s, t in zip(stored, texts) if s != t)
+        runs = 5
+        seconds = min(timeit.repeat(lambda: [decompress_text(s) for s in stored],
+                                    number=1, repeat=runs))
+        print("%-6s %12d %7.1f%% %10d %16.2f" % (
+            codec, size, 100.0 * size / max(raw, 1), compressed,
+            1e6 * seconds / max(len(texts), 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,24 @@ Adapted from django-constance, which itself was adapted from django-adminfiles.
 """
 
 import os
+import shutil
 import sys
+import tempfile
 
 here = os.path.dirname(os.path.abspath(__file__))
 parent = os.path.dirname(here)
 sys.path[0:0] = [here, parent]
 
+# The test database is a file rather than in memory, so the threads of the
+# concurrent posting tests share it.
+test_db_dir = tempfile.mkdtemp()
+
 from django.conf import settings
 settings.configure(
-    DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3'}},
+    DATABASES = {'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'TEST_NAME': os.path.join(test_db_dir, 'test.sqlite3'),
+    }},
     INSTALLED_APPS = [
         "django.contrib.auth",
         "django.contrib.contenttypes",
@@ -33,7 +42,10 @@ from django.test.simple import DjangoTestSuiteRunner
 
 def main():
     runner = DjangoTestSuiteRunner(failfast=True, verbosity=1)
-    failures = runner.run_tests(['testapp'], interactive=True)
+    try:
+        failures = runner.run_tests(['testapp'], interactive=True)
+    finally:
+        shutil.rmtree(test_db_dir)
     sys.exit(failures)
 
 if __name__ == '__main__':
@@ -94,4 +94,10 @@ from .templatetag_tests import *
 from .comment_view_tests import *
 from .moderation_view_tests import *
 from .comment_utils_moderators_tests import *
-
+from .notification_tests import *
+from .spam_tests import *
+from .posting_tests import *
+from .bulk_tests import *
+from .tree_tests import *
+from .archive_tests import *
+from .index_tests import *
@@ -0,0 +1,236 @@
+from __future__ import absolute_import
+
+import datetime
+
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import Http404
+from django.template import Template, Context
+from django.utils import timezone
+
+from comments import archive, signals, utils
+from comments.compression import CODECS, MARKER, compress_text, decompress_text
+from comments.forms import CommentForm
+from comments.models import ArchivedComment, ArchivedObject, Comment
+from comments.posting import save_comment
+
+from . import CommentTestCase, CT
+from .posting_tests import TreeIntegrityMixin
+from ..models import Article
+
+
+class ArchiveTests(TreeIntegrityMixin, CommentTestCase):
+
+    def setUp(self):
+        super(ArchiveTests, self).setUp()
+        cache.clear()
+        self.c1, self.c2, self.c3, self.c4 = self.createSomeComments()
+        self.reply = Comment.objects.create(
+            content_type = self.c1.content_type,
+            object_pk = self.c1.object_pk,
+            parent = self.c1,
+            comment = "Old news.",
+            site = Site.objects.get_current(),
+        )
+        self.article = Article.objects.get(pk=1)
+
+    def tearDown(self):
+        # Don't leave objects which are only archived in this test cached.
+        cache.clear()
+        super(ArchiveTests, self).tearDown()
+
+    def testArchiveObject(self):
+        before = list(Comment.objects.filter(content_type=CT(Article), object_pk="1")
+                      .values_list('pk', 'parent', 'tree_id', 'lft', 'rght'))
+        self.assertEqual(archive.archive_object(CT(Article), "1"), 3)
+        self.assertFalse(Comment.objects.filter(content_type=CT(Article), object_pk="1").exists())
+        self.assertEqual(list(ArchivedComment.objects.values_list('pk', 'parent', 'tree_id', 'lft', 'rght')),
+                         before)
+        self.assertTrue(archive.is_archived(CT(Article), 1))
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def testReadsFromArchive(self):
+        archive.archive_object(CT(Article), "1")
+        qs = utils.get_query_set(target=self.article, root_only=True)
+        self.assertEqual(qs.model, ArchivedComment)
+        self.assertEqual([c.pk for c in qs.order_by('pk')], [self.c1.pk, self.c3.pk])
+        children = utils.get_root_children(qs, CT(Article), "1")
+        self.assertEqual([c.pk for c in children], [self.reply.pk])
+
+        t = "{% load comments_tags %}{% get_comment_count for testapp.article a.id as cc %}{{ cc }}"
+        self.assertEqual(Template(t).render(Context({'a': self.article})), "3")
+
+    def testArchivedCommentsAreReadOnly(self):
+        archive.archive_object(CT(Article), "1")
+        self.assertRaises(NotImplementedError, ArchivedComment.objects.all()[0].save)
+
+    def testPostingRestores(self):
+        archive.archive_object(CT(Article), "1")
+        new = save_comment(Comment(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = "Back from the dead.",
+            site = Site.objects.get_current(),
+        ))
+        self.assertFalse(archive.is_archived(CT(Article), "1"))
+        self.assertEqual(ArchivedComment.objects.count(), 0)
+        self.assertEqual(sorted(Comment.objects.filter(object_pk="1", content_type=CT(Article))
+                                .values_list('pk', flat=True)),
+                         [self.c1.pk, self.c3.pk, self.reply.pk, new.pk])
+        self.assertEqual(Comment.objects.get(pk=self.reply.pk).parent_id, self.c1.pk)
+
+    def testCreateRestores(self):
+        archive.archive_object(CT(Article), "1")
+        new = Comment.objects.create(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = "Back from the dead.",
+            site = Site.objects.get_current(),
+        )
+        self.assertFalse(archive.is_archived(CT(Article), "1"))
+        qs = utils.get_query_set(target=self.article, root_only=True)
+        self.assertEqual(qs.model, Comment)
+        self.assertEqual([c.pk for c in qs.order_by('pk')], [self.c1.pk, self.c3.pk, new.pk])
+
+    def testArchivedLookupIsCached(self):
+        self.assertFalse(archive.is_archived(CT(Article), "1"))
+        with self.assertNumQueries(0):
+            self.assertFalse(archive.is_archived(CT(Article), "1"))
+        archive.archive_object(CT(Article), "1")
+        self.assertTrue(archive.is_archived(CT(Article), "1"))
+        with self.assertNumQueries(2):
+            # The roots and their replies, without looking the archive up.
+            roots = utils.get_query_set(target=self.article, root_only=True)
+            children = list(utils.get_root_children(list(roots), CT(Article), "1"))
+        self.assertEqual([c.pk for c in children], [self.reply.pk])
+        archive.restore_object(CT(Article), "1")
+        self.assertFalse(archive.is_archived(CT(Article), "1"))
+
+    def testRestoreRenumbersTakenKeys(self):
+        archive.archive_object(CT(Article), "1")
+        # Another comment took one of the archived keys meanwhile.
+        Comment.objects.filter(pk=self.c2.pk).update(id=self.c3.pk)
+        self.assertEqual(archive.restore_object(CT(Article), "1"), 3)
+        reply = Comment.objects.get(comment="Old news.")
+        self.assertNotEqual(reply.pk, self.reply.pk)
+        self.assertEqual(reply.parent.comment, self.c1.comment)
+        self.assertTreeIntact(reply.tree_id)
+        self.assertEqual(Comment.objects.count(), 5)
+
+    def testNoRepliesToArchivedComments(self):
+        archive.archive_object(CT(Article), "1")
+        self.assertRaises(Comment.DoesNotExist, CommentForm, parent_pk=self.c1.pk)
+        # Nor to a comment which took the key of an archived one.
+        Comment.objects.filter(pk=self.c2.pk).update(id=self.c1.pk)
+        self.assertRaises(Comment.DoesNotExist, CommentForm, parent_pk=self.c1.pk)
+
+    def testPermalinksOfArchivedComments(self):
+        archive.archive_object(CT(Article), "1")
+        self.assertEqual(utils.get_comment(self.reply.pk).__class__, ArchivedComment)
+        self.assertEqual(utils.get_comment(self.c2.pk).__class__, Comment)
+        self.assertRaises(Http404, utils.get_comment, 999)
+
+    def testMovingSendsOneChange(self):
+        changes = []
+        def receiver(sender, tree_ids, **kwargs):
+            changes.append(tree_ids)
+        signals.comment_threads_were_changed.connect(receiver)
+        try:
+            archive.archive_object(CT(Article), "1")
+            archive.restore_object(CT(Article), "1")
+        finally:
+            signals.comment_threads_were_changed.disconnect(receiver)
+        tree_ids = sorted([self.c1.tree_id, self.c3.tree_id])
+        self.assertEqual(changes, [tree_ids, tree_ids])
+
+    def testArchiveCommand(self):
+        Comment.objects.filter(content_type=CT(Article)).update(
+            submit_date=timezone.now() - datetime.timedelta(days=400))
+        self.assertEqual(len(archive.archivable_objects(timezone.now() - datetime.timedelta(days=365))), 1)
+        call_command('archive_comments', verbosity=0)
+        self.assertEqual(list(ArchivedObject.objects.values_list('object_pk', flat=True)), ["1"])
+        self.assertEqual(ArchivedComment.objects.count(), 3)
+
+
+class ArchiveCompressionTests(CommentTestCase):
+
+    text = u"Ceci n'est pas une pipe. " * 40
+
+    def setUp(self):
+        super(ArchiveCompressionTests, self).setUp()
+        self.long = Comment.objects.create(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = self.text,
+            site = Site.objects.get_current(),
+        )
+        self.short = Comment.objects.create(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = u"Short.",
+            site = Site.objects.get_current(),
+        )
+        self.old_compression = archive.COMMENTS_ARCHIVE_COMPRESSION
+        archive.COMMENTS_ARCHIVE_COMPRESSION = 'zlib'
+        cache.clear()
+
+    def tearDown(self):
+        archive.COMMENTS_ARCHIVE_COMPRESSION = self.old_compression
+        cache.clear()
+        super(ArchiveCompressionTests, self).tearDown()
+
+    def stored(self, pk):
+        return ArchivedComment.objects.filter(pk=pk).values_list('comment', flat=True)[0]
+
+    def testCompressedRoundTrip(self):
+        self.assertEqual(compress_text(u"", 'zlib'), u"")
+        for codec in CODECS:
+            compressed = compress_text(self.text, codec)
+            self.assertTrue(len(compressed) < len(self.text))
+            self.assertEqual(decompress_text(compressed), self.text)
+        self.assertEqual(decompress_text(u"Plain."), u"Plain.")
+
+    def testArchiveCompresses(self):
+        archive.archive_object(CT(Article), "1")
+        self.assertTrue(len(self.stored(self.long.pk)) < len(self.text))
+        self.assertEqual(self.stored(self.short.pk), u"Short.")
+        self.assertEqual(ArchivedComment.objects.get(pk=self.long.pk).comment, self.text)
+
+    def testRestoreDecompresses(self):
+        archive.archive_object(CT(Article), "1")
+        archive.restore_object(CT(Article), "1")
+        self.assertEqual(Comment.objects.get(pk=self.long.pk).comment, self.text)
+
+    def testCompressArchive(self):
+        archive.COMMENTS_ARCHIVE_COMPRESSION = None
+        archive.archive_object(CT(Article), "1")
+        self.assertEqual(self.stored(self.long.pk), self.text)
+        self.assertEqual(archive.compress_archive('zlib', batch_size=1), 1)
+        self.assertEqual(decompress_text(self.stored(self.long.pk)), self.text)
+        self.assertEqual(archive.compress_archive('zlib'), 0)
+
+    def testMarkerPrefixedText(self):
+        text = MARKER + u"raw:Not compressed."
+        marked = Comment.objects.create(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = text,
+            site = Site.objects.get_current(),
+        )
+        corrupt = MARKER + u"zlib:not base64"
+        self.assertEqual(decompress_text(corrupt), corrupt)
+        self.assertEqual(decompress_text(compress_text(text, 'zlib')), text)
+        self.assertEqual(decompress_text(compress_text(text, None)), text)
+        for codec in (None, 'zlib'):
+            archive.COMMENTS_ARCHIVE_COMPRESSION = codec
+            archive.archive_object(CT(Article), "1")
+            self.assertEqual(ArchivedComment.objects.get(pk=marked.pk).comment, text)
+            self.assertEqual(len(ArchivedComment.objects.all()), 3)
+            archive.restore_object(CT(Article), "1")
+            self.assertEqual(Comment.objects.get(pk=marked.pk).comment, text)
+
+    def testUnknownCodec(self):
+        archive.COMMENTS_ARCHIVE_COMPRESSION = 'rot13'
+        self.assertRaises(ImproperlyConfigured, archive.archive_object, CT(Article), "1")
@@ -0,0 +1,277 @@
+from __future__ import absolute_import
+
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.sites.models import Site
+from django.core.cache import get_cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from comments import archive, feeds, signals
+from comments.bulk import (anonymize_comments, comment_records, erase_user_comments,
+    expire_personal_data, import_comments)
+from comments.managers import CommentTreeManager
+from comments.models import Comment, CommentFlag, invalidate_feeds
+
+from . import CommentTestCase, CT
+from .posting_tests import TreeIntegrityMixin
+from ..models import Article
+
+
+def thread_records(prefix, object_pk="1"):
+    """
+    A thread with replies given out of date order:
+
+        root
+          a (10:05)
+            c
+          b (10:01)
+    """
+    base = {'content_type': 'testapp.article', 'object_pk': object_pk, 'user_name': 'Legacy'}
+    records = [
+        dict(base, id=prefix + 'root', comment='Root', submit_date='2010-01-01T10:00:00'),
+        dict(base, id=prefix + 'a', parent=prefix + 'root', comment='A', submit_date='2010-01-01T10:05:00'),
+        dict(base, id=prefix + 'c', parent=prefix + 'a', comment='C', submit_date='2010-01-01T10:06:00'),
+        dict(base, id=prefix + 'b', parent=prefix + 'root', comment='B', submit_date='2010-01-01T10:01:00'),
+    ]
+    return records
+
+
+class ImportCommentsTests(TreeIntegrityMixin, CommentTestCase):
+
+    def testImport(self):
+        existing = self.createSomeComments()
+        count = import_comments(thread_records('x') + thread_records('y', "2"), chunk_size=3)
+        self.assertEqual(count, 8)
+
+        roots = Comment.objects.filter(comment='Root', parent__isnull=True).order_by('pk')
+        self.assertEqual(len(roots), 2)
+        for root in roots:
+            self.assertTreeIntact(root.tree_id)
+            self.assertEqual([c.comment for c in root.get_descendants()], ['B', 'A', 'C'])
+            self.assertEqual(root.content_type, CT(Article))
+        self.assertEqual(len(set(c.tree_id for c in existing) | set(r.tree_id for r in roots)), 6)
+
+    def testCommentsPostedAfterAnImport(self):
+        import_comments(thread_records('x'))
+        c = Comment.objects.create(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = "Fresh",
+            site = Site.objects.get_current(),
+        )
+        self.assertEqual(Comment.objects.filter(tree_id=c.tree_id).count(), 1)
+        self.assertEqual(Comment.objects.count(), 5)
+
+    def testPostsAndImportsTakeDistinctTreeIds(self):
+        self.assertTrue(isinstance(Comment._tree_manager, CommentTreeManager))
+        for i in range(2):
+            Comment.objects.create(
+                content_type = CT(Article),
+                object_pk = "1",
+                comment = "Fresh %d" % i,
+                site = Site.objects.get_current(),
+            )
+            import_comments(thread_records('x%d' % i))
+        roots = Comment.objects.filter(parent__isnull=True)
+        self.assertEqual(len(set(roots.values_list('tree_id', flat=True))), 4)
+        for root in roots:
+            self.assertTreeIntact(root.tree_id)
+
+    def testReplyBeforeParent(self):
+        records = thread_records('x')
+        records[1], records[2] = records[2], records[1]
+        self.assertRaises(ValueError, import_comments, records)
+
+    def testCommentsPostedAfterAFailedImport(self):
+        # Two threads are written before a third one replies to the second.
+        records = thread_records('x') + thread_records('y', "2") + thread_records('z')[:1]
+        records.append(dict(records[-1], id='za', parent='yroot'))
+        self.assertRaises(ValueError, import_comments, records, chunk_size=1)
+        self.assertEqual(Comment.objects.count(), 8)
+        c = Comment.objects.create(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = "Fresh",
+            site = Site.objects.get_current(),
+        )
+        self.assertEqual(Comment.objects.filter(tree_id=c.tree_id).count(), 1)
+        self.assertEqual(Comment.objects.count(), 9)
+
+    def testImportCommand(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'comments.jsonl')
+            with io.open(path, 'w', encoding='utf-8') as f:
+                for record in thread_records('x'):
+                    f.write(json.dumps(record) + u'\n')
+            call_command('import_comments', path, verbosity=0)
+            self.assertEqual(Comment.objects.count(), 4)
+            self.assertRaises(CommandError, call_command, 'import_comments', verbosity=0)
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class ExportCommentsTests(TreeIntegrityMixin, CommentTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def readLines(self, path, opener=io.open):
+        with opener(path, 'rb') as f:
+            return [json.loads(line.decode('utf-8')) for line in f]
+
+    def testCommentRecordsChunks(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        records = list(comment_records(Comment.objects.all(), chunk_size=3))
+        self.assertEqual([r['id'] for r in records], [c1.pk, c2.pk, c3.pk, c4.pk])
+        self.assertEqual(records[0]['content_type'], 'testapp.article')
+        self.assertEqual(records[0]['parent'], None)
+
+    def testExportCommand(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        path = os.path.join(self.tempdir, 'comments.jsonl')
+        call_command('export_comments', output=path, content_types=['testapp.author'], verbosity=0)
+        self.assertEqual([r['id'] for r in self.readLines(path)], [c2.pk, c4.pk])
+
+    def testExportArchivedComments(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        long_text = u"Ceci n'est pas une pipe. " * 40
+        Comment.objects.filter(pk=c1.pk).update(comment=long_text)
+        old_compression = archive.COMMENTS_ARCHIVE_COMPRESSION
+        archive.COMMENTS_ARCHIVE_COMPRESSION = 'zlib'
+        try:
+            archive.archive_object(CT(Article), "1")
+        finally:
+            archive.COMMENTS_ARCHIVE_COMPRESSION = old_compression
+        path = os.path.join(self.tempdir, 'comments.jsonl')
+        call_command('export_comments', output=path, verbosity=0)
+        records = self.readLines(path)
+        self.assertEqual(sorted(r['id'] for r in records), sorted(c.pk for c in (c1, c2, c3, c4)))
+        self.assertEqual([r['comment'] for r in records if r['id'] == c1.pk], [long_text])
+
+    def testExportFlags(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        CommentFlag.objects.create(comment=c1, user=c4.user, flag=CommentFlag.SUGGEST_REMOVAL)
+        path = os.path.join(self.tempdir, 'flags.jsonl')
+        call_command('export_comments', output=path, flags=True, verbosity=0)
+        records = self.readLines(path)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['comment'], c1.pk)
+
+    def testGzipRoundTrip(self):
+        c1 = self.createSomeComments()[0]
+        Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            parent = c1,
+            comment = "Reply",
+            site = Site.objects.get_current(),
+        )
+        path = os.path.join(self.tempdir, 'comments.jsonl.gz')
+        call_command('export_comments', output=path, since='2000-01-01', verbosity=0)
+        self.assertEqual(len(self.readLines(path, gzip.open)), 5)
+
+        Comment.objects.all().delete()
+        call_command('import_comments', path, verbosity=0)
+        reply = Comment.objects.get(comment="Reply")
+        self.assertEqual(reply.parent.comment, c1.comment)
+        self.assertTreeIntact(reply.tree_id)
+        self.assertEqual(Comment.objects.count(), 5)
+
+
+class EraseCommentsTests(TreeIntegrityMixin, CommentTestCase):
+
+    def setUp(self):
+        super(EraseCommentsTests, self).setUp()
+        self.c1, self.c2, self.c3, self.c4 = self.createSomeComments()
+        self.user = self.c3.user
+        self.reply = Comment.objects.create(
+            content_type = self.c1.content_type,
+            object_pk = self.c1.object_pk,
+            parent = self.c3,
+            user = self.user,
+            comment = "Me again.",
+            ip_address = "10.0.0.1",
+            site = Site.objects.get_current(),
+        )
+        self.changed = []
+        signals.comment_threads_were_changed.connect(self.threadsChanged)
+
+    def tearDown(self):
+        signals.comment_threads_were_changed.disconnect(self.threadsChanged)
+        super(EraseCommentsTests, self).tearDown()
+
+    def threadsChanged(self, sender, tree_ids, **kwargs):
+        self.changed.append(tree_ids)
+
+    def testEraseUserComments(self):
+        before = list(Comment.objects.values_list('pk', 'tree_id', 'lft', 'rght', 'parent'))
+        self.assertEqual(erase_user_comments(self.user, chunk_size=1), 3)
+        erased = Comment.objects.filter(pk__in=[self.c3.pk, self.c4.pk, self.reply.pk])
+        self.assertEqual(set(erased.values_list('user', 'user_name', 'user_email', 'user_url',
+                                                'ip_address', 'is_removed')),
+                         set([(None, '', '', '', None, False)]))
+        self.assertEqual(Comment.objects.get(pk=self.c1.pk).user_name, self.c1.user_name)
+        self.assertEqual(list(Comment.objects.values_list('pk', 'tree_id', 'lft', 'rght', 'parent')),
+                         before)
+        self.assertTreeIntact(self.c3.tree_id)
+        # One signal for all the threads.
+        self.assertEqual(self.changed, [sorted([self.c3.tree_id, self.c4.tree_id])])
+
+    def testEraseDropsCachedFeeds(self):
+        # comments.models connects the feeds' receiver, whether or not
+        # comments.feeds was imported.
+        self.assertTrue(any(receiver() is invalidate_feeds for key, receiver
+                            in signals.comment_threads_were_changed.receivers))
+        cache = get_cache(feeds.COMMENTS_FEED_CACHE)
+        cache.set(feeds.FEED_GENERATION_KEY, 'before')
+        erase_user_comments(self.user)
+        self.assertNotEqual(cache.get(feeds.FEED_GENERATION_KEY), 'before')
+
+    def testAnonymizeAndRemove(self):
+        qs = Comment.objects.filter(pk=self.c1.pk)
+        self.assertEqual(anonymize_comments(qs, remove=True), 1)
+        c1 = Comment.objects.get(pk=self.c1.pk)
+        self.assertEqual((c1.user_name, c1.is_removed), ('', True))
+        self.assertEqual(anonymize_comments(Comment.objects.none()), 0)
+        self.assertEqual(len(self.changed), 1)
+
+
+class ExpirePersonalDataTests(CommentTestCase):
+
+    def setUp(self):
+        super(ExpirePersonalDataTests, self).setUp()
+        self.c1, self.c2, self.c3, self.c4 = self.createSomeComments()
+        Comment.objects.update(ip_address="10.0.0.1")
+        Comment.objects.filter(pk__in=[self.c1.pk, self.c2.pk, self.c3.pk]).update(
+            submit_date=timezone.now() - datetime.timedelta(days=400))
+
+    def testExpire(self):
+        before = timezone.now() - datetime.timedelta(days=365)
+        self.assertEqual(expire_personal_data(before, chunk_size=2), 3)
+        old = Comment.objects.filter(pk__in=[self.c1.pk, self.c2.pk, self.c3.pk])
+        self.assertEqual(set(old.values_list('ip_address', 'user_email')), set([(None, '')]))
+        self.assertEqual(Comment.objects.get(pk=self.c1.pk).user_url, self.c1.user_url)
+        self.assertEqual(Comment.objects.get(pk=self.c4.pk).ip_address, "10.0.0.1")
+        # Nothing left to expire.
+        self.assertEqual(expire_personal_data(before), 0)
+        self.assertRaises(ValueError, expire_personal_data, before, ['comment'])
+
+    def testCommand(self):
+        call_command('expire_comment_data', days=365, fields='ip_address', verbosity=0)
+        self.assertEqual(Comment.objects.filter(ip_address__isnull=True).count(), 3)
+        self.assertEqual(Comment.objects.get(pk=self.c1.pk).user_email, self.c1.user_email)
+        self.assertRaises(CommandError, call_command, 'expire_comment_data', verbosity=0)
+        self.assertRaises(CommandError, call_command, 'expire_comment_data', days=1,
+                          fields='comment', verbosity=0)
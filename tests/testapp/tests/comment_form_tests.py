@@ -61,6 +61,12 @@ class CommentFormTests(CommentTestCase):
         c.save()
         self.assertEqual(Comment.objects.count(), 1)
 
+    def testGetCommentObjectCachesTarget(self):
+        a = Article.objects.get(pk=1)
+        f = CommentForm(target=a)
+        with self.assertNumQueries(0):
+            self.assertTrue(f.instance.content_object is a)
+
     def testProfanities(self):
         """Test COMMENTS_ALLOW_PROFANITIES and PROFANITIES_LIST settings"""
         a = Article.objects.get(pk=1)
@@ -1,13 +1,20 @@
 from __future__ import absolute_import
 
+from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.contrib.sites.models import Site
 from django.core import mail
+from django.test.client import RequestFactory
 from django.test.utils import override_settings
 
-from comments.models import Comment
+from comments import signals
+from comments.models import Comment, CommentFingerprint
 from comments.moderation import (moderator, CommentModerator,
     AlreadyModerated)
+from comments.ratelimit import LocalCounterStore, SlidingWindowRateLimiter
+from comments.views.moderation import perform_approve, perform_flag
 
-from . import CommentTestCase
+from . import CommentTestCase, CT
 from ..models import Entry
 
 
@@ -33,6 +40,16 @@ class EntryModerator6(CommentModerator):
     auto_close_field = 'pub_date'
     close_after = 0
 
+class EntryModerator7(CommentModerator):
+    hide_after_flags = 2
+
+class EntryModerator8(CommentModerator):
+    duplicate_distance = 8
+
+class EntryModerator9(CommentModerator):
+    flood_limit = 2
+    flood_period = 60
+
 class CommentUtilsModeratorTests(CommentTestCase):
     fixtures = ["comment_utils.xml"]
 
@@ -98,3 +115,152 @@ class CommentUtilsModeratorTests(CommentTestCase):
         moderator.register(Entry, EntryModerator6)
         c1, c2 = self.createSomeComments()
         self.assertEqual(Comment.objects.all().count(), 0)
+
+class FlagModerationTests(CommentTestCase):
+    fixtures = ["comment_tests", "comment_utils.xml"]
+
+    def setUp(self):
+        moderator.register(Entry, EntryModerator7)
+
+    def tearDown(self):
+        moderator.unregister(Entry)
+
+    def flag(self, comment, username):
+        request = RequestFactory().post("/flag/%d/" % comment.pk)
+        request.user = User.objects.get_or_create(username=username)[0]
+        perform_flag(request, comment)
+
+    def testHideAfterFlags(self):
+        c = Comment.objects.create(
+            content_type = CT(Entry),
+            object_pk = "1",
+            user_name = "Joe Somebody",
+            comment = "Buy cheap pills!",
+            site = Site.objects.get_current(),
+        )
+        self.flag(c, "normaluser")
+        self.flag(c, "normaluser")
+        self.assertTrue(Comment.objects.get(pk=c.pk).is_public)
+
+        changed = []
+        def threads_changed(sender, tree_ids, **kwargs):
+            changed.append(tree_ids)
+        signals.comment_threads_were_changed.connect(threads_changed)
+        try:
+            self.flag(c, "otheruser")
+        finally:
+            signals.comment_threads_were_changed.disconnect(threads_changed)
+        self.assertFalse(c.is_public)
+        self.assertEqual(list(Comment.objects.in_moderation()), [c])
+        # Hiding is a queryset update, so the feeds are told separately.
+        self.assertEqual(changed, [[c.tree_id]])
+
+    def testApprovedCommentsAreHiddenByNewFlagsOnly(self):
+        c = Comment.objects.create(
+            content_type = CT(Entry),
+            object_pk = "1",
+            user_name = "Joe Somebody",
+            comment = "An unpopular opinion.",
+            site = Site.objects.get_current(),
+        )
+        self.flag(c, "normaluser")
+        self.flag(c, "otheruser")
+        self.assertFalse(c.is_public)
+
+        request = RequestFactory().post("/approve/%d/" % c.pk)
+        request.user = User.objects.get_or_create(username="moderator")[0]
+        perform_approve(request, c)
+        self.assertTrue(Comment.objects.get(pk=c.pk).is_public)
+
+        # The suggestions made before the approval don't count.
+        self.flag(c, "thirduser")
+        self.assertTrue(Comment.objects.get(pk=c.pk).is_public)
+        self.flag(c, "fourthuser")
+        self.assertFalse(Comment.objects.get(pk=c.pk).is_public)
+
+class NearDuplicateModerationTests(CommentTestCase):
+    fixtures = ["comment_utils.xml"]
+
+    def setUp(self):
+        moderator.register(Entry, EntryModerator8)
+
+    def tearDown(self):
+        moderator.unregister(Entry)
+
+    def makeComment(self, text, object_pk="1"):
+        return Comment(
+            content_type = CT(Entry),
+            object_pk = object_pk,
+            user_name = "Joe Somebody",
+            comment = text,
+            site = Site.objects.get_current(),
+        )
+
+    def postComment(self, comment):
+        moderator.pre_save_moderation(Comment, comment=comment, request=None)
+        comment.save()
+        moderator.post_save_moderation(Comment, comment=comment, request=None)
+        return comment
+
+    def testNearDuplicates(self):
+        c1 = self.postComment(self.makeComment(
+            "Get the best deals on cheap watches at our online store, free shipping "
+            "worldwide and great discounts every single day for new customers"))
+        self.assertTrue(c1.is_public)
+        self.assertEqual(CommentFingerprint.objects.filter(comment=c1).count(), 16)
+
+        # A slight variant on another object is routed to moderation.
+        c2 = self.postComment(self.makeComment(
+            "Get the best deals on cheap watches at our online shop, free shipping "
+            "worldwide and great discounts every single day for new customers",
+            object_pk="2"))
+        self.assertFalse(c2.is_public)
+
+        c3 = self.postComment(self.makeComment(
+            "I really enjoyed this article about gardening, the tomato tips were useful"))
+        self.assertTrue(c3.is_public)
+
+    def testNoWords(self):
+        # Texts without words aren't fingerprinted, nor duplicates of each other.
+        for text in ("", "!!!", "?!"):
+            c = self.postComment(self.makeComment(text))
+            self.assertTrue(c.is_public)
+            self.assertFalse(CommentFingerprint.objects.filter(comment=c).exists())
+
+class FloodModerationTests(CommentTestCase):
+    fixtures = ["comment_utils.xml"]
+
+    def setUp(self):
+        get_cache('default').clear()
+        moderator.register(Entry, EntryModerator9)
+
+    def tearDown(self):
+        moderator.unregister(Entry)
+
+    def preSaveModeration(self, ip_address):
+        comment = Comment(
+            content_type = CT(Entry),
+            object_pk = "1",
+            user_name = "Joe Somebody",
+            comment = "Hello",
+            ip_address = ip_address,
+            site = Site.objects.get_current(),
+        )
+        return moderator.pre_save_moderation(Comment, comment=comment, request=None)
+
+    def testFloodLimit(self):
+        self.assertNotEqual(self.preSaveModeration("1.2.3.4"), False)
+        self.assertNotEqual(self.preSaveModeration("1.2.3.4"), False)
+        self.assertEqual(self.preSaveModeration("1.2.3.4"), False)
+        # Other posters aren't affected.
+        self.assertNotEqual(self.preSaveModeration("5.6.7.8"), False)
+
+    def testSlidingWindow(self):
+        limiter = SlidingWindowRateLimiter(store=LocalCounterStore())
+        self.assertTrue(limiter.hit("key", 2, 60, now=120))
+        self.assertTrue(limiter.hit("key", 2, 60, now=150))
+        # Early in the next period most of the previous hits still count.
+        self.assertFalse(limiter.hit("key", 2, 60, now=185))
+        # Once the window has slid past them, posting is allowed again.
+        self.assertTrue(limiter.hit("other", 2, 60, now=185))
+        self.assertTrue(limiter.hit("key", 2, 60, now=300))
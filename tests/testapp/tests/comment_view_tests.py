@@ -323,3 +323,40 @@ class CommentViewTests(CommentTestCase):
         location = response["Location"]
         match = re.search(r"^http://testserver/somewhere/else/\?c=\d+#baz$", location)
         self.assertTrue(match != None, "Unexpected redirect location: %s" % location)
+
+
+class UserCommentsViewTests(CommentTestCase):
+
+    def setUp(self):
+        super(UserCommentsViewTests, self).setUp()
+        self.c1, self.c2, self.c3, self.c4 = self.createSomeComments()
+        self.user = self.c3.user
+
+    def testForUser(self):
+        # c3 and c4 were posted in the same order they're dated.
+        self.assertEqual(list(Comment.objects.for_user(self.user)), [self.c4, self.c3])
+        self.assertEqual(list(Comment.objects.for_user(self.user, after=self.c4.pk)), [self.c3])
+        self.assertEqual(list(Comment.objects.for_user(self.user, after=self.c3.pk)), [])
+        self.c4.is_removed = True
+        self.c4.save()
+        self.assertEqual(list(Comment.objects.for_user(self.user.pk)), [self.c3])
+
+    def testView(self):
+        from comments.views import list as list_views
+        per_page = list_views.COMMENTS_PER_PAGE
+        list_views.COMMENTS_PER_PAGE = 1
+        try:
+            response = self.client.get("/user/%s/" % self.user.pk)
+            self.assertTemplateUsed(response, "comments/user_comments.html")
+            self.assertEqual(response.context["comment_list"], [self.c4])
+            self.assertEqual(response.context["next_after"], self.c4.pk)
+            self.assertContains(response, "Peter Jones")
+
+            response = self.client.get("/user/%s/?after=%s" % (self.user.pk, self.c4.pk))
+            self.assertEqual(response.context["comment_list"], [self.c3])
+            self.assertEqual(response.context["next_after"], None)
+        finally:
+            list_views.COMMENTS_PER_PAGE = per_page
+
+        self.assertEqual(self.client.get("/user/999/").status_code, 404)
+        self.assertEqual(self.client.get("/user/%s/?after=x" % self.user.pk).status_code, 404)
@@ -5,6 +5,7 @@ from xml.etree import ElementTree as ET
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 
 from comments.models import Comment
 
@@ -17,6 +18,7 @@ class CommentFeedTests(CommentTestCase):
     feed_url = '/rss/comments/'
 
     def setUp(self):
+        cache.clear()
         site_2 = Site.objects.create(id=settings.SITE_ID+1,
             domain="example2.com", name="example2.com")
         # A comment for another site
@@ -30,6 +32,9 @@ class CommentFeedTests(CommentTestCase):
             site = site_2,
         )
 
+    def item_link(self, comment):
+        return "%s</link>" % comment.get_absolute_url()
+
     def test_feed(self):
         response = self.client.get(self.feed_url)
         self.assertEqual(response.status_code, 200)
@@ -52,3 +57,67 @@ class CommentFeedTests(CommentTestCase):
         self.assertEqual(atomlink_elem.attrib, {"href": "http://example.com/rss/comments/", "rel": "self"})
 
         self.assertNotContains(response, "A comment for the second site.")
+
+    def test_feed_is_cached(self):
+        self.createSomeComments()
+        response = self.client.get(self.feed_url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        # The latest comment is all a cached feed is checked against, and
+        # query strings don't make new cache entries.
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.feed_url, {'nocache': '1'})
+        self.assertEqual(cached.content, response.content)
+
+        c = Comment.objects.create(
+            content_type = ContentType.objects.get_for_model(Article),
+            object_pk = "1",
+            user_name = "Joe Somebody",
+            comment = "Hot off the press.",
+            site = Site.objects.get_current(),
+        )
+        self.assertContains(self.client.get(self.feed_url), self.item_link(c))
+
+    def test_changed_comments_drop_cached_feeds(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        self.assertContains(self.client.get(self.feed_url), self.item_link(c3))
+        c3.is_removed = True
+        c3.save()
+        self.assertNotContains(self.client.get(self.feed_url), self.item_link(c3))
+
+        # c4 is the latest comment, which the cache key changes with anyway.
+        self.assertContains(self.client.get(self.feed_url), self.item_link(c2))
+        c2.delete()
+        self.assertNotContains(self.client.get(self.feed_url), self.item_link(c2))
+
+    def test_conditional_get(self):
+        self.createSomeComments()
+        response = self.client.get(self.feed_url)
+        response = self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.feed_url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_feed_queries(self):
+        self.createSomeComments()
+        # The latest comment, the items, and one query per content type.
+        with self.assertNumQueries(4):
+            self.client.get(self.feed_url)
+
+    def test_object_feed(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        response = self.client.get('/rss/comments/testapp.article/1/')
+        self.assertContains(response, "Man Bites Dog")
+        self.assertContains(response, c1.comment)
+        self.assertNotContains(response, c2.comment)
+        self.assertNotContains(response, "A comment for the second site.")
+        self.assertTrue(response.has_header('ETag'))
+        self.assertEqual(self.client.get('/rss/comments/testapp.article/99/').status_code, 404)
+        self.assertEqual(self.client.get('/rss/comments/testapp.nothing/1/').status_code, 404)
+
+    def test_user_feed(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        response = self.client.get('/rss/comments/user/%s/' % c3.user_id)
+        self.assertContains(response, c3.comment)
+        self.assertNotContains(response, c1.comment)
+        self.assertEqual(self.client.get('/rss/comments/user/999/').status_code, 404)
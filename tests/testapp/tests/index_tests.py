@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+
+from django.db import connection
+from django.utils import unittest
+
+from comments import managers, utils
+from comments.models import Comment
+
+from . import CommentTestCase
+from ..models import Article
+
+# The indexes declared on Comment, by the fields they're on.
+LIST_INDEX = ('content_type', 'object_pk', 'site', 'is_public', 'is_removed', 'tree_id', 'lft')
+ROOTS_INDEX = ('content_type', 'object_pk', 'site', 'parent', 'level', 'submit_date')
+LATEST_INDEX = ('content_type', 'object_pk', 'site', 'submit_date')
+MODERATION_INDEX = ('is_public', 'is_removed', 'suggest_removal_count', 'submit_date')
+USER_INDEX = ('user', 'site', 'submit_date')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "Query plans are checked on SQLite.")
+class QueryPlanTests(CommentTestCase):
+    """
+    The comment list, count and moderation queue queries use the composite
+    indexes declared for them.
+    """
+
+    integer_pks = False
+
+    def setUp(self):
+        super(QueryPlanTests, self).setUp()
+        self.old_integer_pks = managers.COMMENTS_INTEGER_OBJECT_PKS
+        managers.COMMENTS_INTEGER_OBJECT_PKS = self.integer_pks
+        self.createSomeComments()
+        self.article = Article.objects.get(pk=1)
+
+    def tearDown(self):
+        managers.COMMENTS_INTEGER_OBJECT_PKS = self.old_integer_pks
+        super(QueryPlanTests, self).tearDown()
+
+    def indexName(self, model, fields):
+        if self.integer_pks and 'object_pk' in fields:
+            fields = ['object_pk_int' if f == 'object_pk' else f for f in fields]
+        self.assertTrue(tuple(fields) in [tuple(f) for f in model._meta.index_together])
+        columns = [model._meta.get_field(f).column for f in fields]
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA index_list(%s)" % connection.ops.quote_name(model._meta.db_table))
+        for row in cursor.fetchall():
+            name = row[1]
+            cursor.execute("PRAGMA index_info(%s)" % connection.ops.quote_name(name))
+            if [info[2] for info in cursor.fetchall()] == columns:
+                return name
+        self.fail("No index on %s." % ', '.join(columns))
+
+    def queryPlan(self, qs, count=False):
+        query = qs.query
+        if count:
+            # The query QuerySet.count() runs.
+            query = query.clone()
+            query.add_count_column()
+            query.clear_ordering(True)
+            query.select = []
+            query.default_cols = False
+        sql, params = query.get_compiler(qs.db).as_sql()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, qs, fields, count=False):
+        name = self.indexName(qs.model, fields)
+        plan = self.queryPlan(qs, count)
+        self.assertTrue("INDEX %s" % name in plan, plan)
+
+    def testList(self):
+        qs = utils.get_query_set(target=self.article, tree_ids=[1, 2], except_root=True)
+        self.assertUsesIndex(qs, LIST_INDEX)
+
+    def testRootOnly(self):
+        qs = utils.get_query_set(target=self.article, root_only=True).order_by('level', 'submit_date')
+        self.assertUsesIndex(qs, ROOTS_INDEX)
+        self.assertFalse("TEMP B-TREE" in self.queryPlan(qs))
+
+    def testCount(self):
+        qs = utils.get_query_set(target=self.article).order_by()
+        self.assertUsesIndex(qs, LIST_INDEX, count=True)
+
+    def testModerationQueue(self):
+        qs = Comment.objects.moderation_queue()
+        self.assertUsesIndex(qs, MODERATION_INDEX)
+
+    def testObjectFeed(self):
+        qs = utils.get_query_set(target=self.article).order_by('-submit_date')
+        self.assertUsesIndex(qs, LATEST_INDEX)
+        self.assertFalse("TEMP B-TREE" in self.queryPlan(qs))
+
+    def testUserFeed(self):
+        qs = Comment.objects.filter(user=1, site=1, is_public=True, is_removed=False)
+        qs = qs.order_by('-submit_date')
+        self.assertUsesIndex(qs, USER_INDEX)
+        self.assertFalse("TEMP B-TREE" in self.queryPlan(qs))
+
+
+class IntegerKeyQueryPlanTests(QueryPlanTests):
+    """
+    The same queries use the indexes on object_pk_int when objects with
+    integer keys are looked up on it.
+    """
+
+    integer_pks = True
@@ -1,9 +1,18 @@
 from __future__ import absolute_import
 
-from comments.models import Comment
+import datetime
 
-from . import CommentTestCase
-from ..models import Author, Article
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import models
+
+from comments import managers
+from comments.bulk import fill_object_pk_ints, recount_flag_counters
+from comments.managers import integer_pk, object_pk_lookup
+from comments.models import Comment, CommentFlag, CommentTreeId
+
+from . import CommentTestCase, CT
+from ..models import Author, Article, Book
 
 
 class CommentModelTests(CommentTestCase):
@@ -20,6 +29,101 @@ class CommentModelTests(CommentTestCase):
         self.assertEqual(c1.user, None)
         self.assertEqual(c3.user, c4.user)
 
+    def testRootCommentsStartTheirOwnTree(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        tree_ids = [c.tree_id for c in (c1, c2, c3, c4)]
+        self.assertEqual(len(set(tree_ids)), 4)
+        self.assertEqual(sorted(tree_ids), list(CommentTreeId.objects.values_list('pk', flat=True).order_by('pk')))
+        self.assertEqual([(c.lft, c.rght, c.level) for c in (c1, c2, c3, c4)], [(1, 2, 0)] * 4)
+
+    def testBackdatedRootCommentLeavesOtherTreesAlone(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        before = dict(Comment.objects.values_list('pk', 'tree_id'))
+        Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            comment = "Catching up.",
+            submit_date = c1.submit_date - datetime.timedelta(days=1),
+            site = Site.objects.get_current(),
+        )
+        after = dict(Comment.objects.filter(pk__in=before).values_list('pk', 'tree_id'))
+        self.assertEqual(before, after)
+
+    def testRepliesJoinTheirParentsTree(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        reply = Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            parent = c1,
+            comment = "Indeed.",
+            site = Site.objects.get_current(),
+        )
+        c1 = Comment.objects.get(pk=c1.pk)
+        self.assertEqual(reply.tree_id, c1.tree_id)
+        self.assertEqual((c1.lft, c1.rght, reply.lft, reply.rght), (1, 4, 2, 3))
+        self.assertEqual(CommentTreeId.objects.count(), 4)
+
+    def testNewRepliesAreAppended(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        replies = [Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            parent = Comment.objects.get(pk=c1.pk),
+            comment = "Reply %d" % i,
+            site = Site.objects.get_current(),
+        ) for i in range(3)]
+        children = list(Comment.objects.get(pk=c1.pk).get_children())
+        self.assertEqual(children, replies)
+        self.assertEqual([(c.lft, c.rght) for c in children], [(2, 3), (4, 5), (6, 7)])
+
+    def testRepliesThroughTheSameParent(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        replies = [Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            parent = c1,
+            comment = "Reply %d" % i,
+            site = Site.objects.get_current(),
+        ) for i in range(2)]
+        children = list(Comment.objects.get(pk=c1.pk).get_children())
+        self.assertEqual(children, replies)
+        self.assertEqual([(c.lft, c.rght) for c in children], [(2, 3), (4, 5)])
+        self.assertEqual(Comment.objects.get(pk=c1.pk).rght, 6)
+
+    def testBackdatedRepliesAreInsertedInDateOrder(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        later = Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            parent = c1,
+            comment = "Posted now.",
+            site = Site.objects.get_current(),
+        )
+        earlier = Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            parent = Comment.objects.get(pk=c1.pk),
+            comment = "Imported.",
+            submit_date = later.submit_date - datetime.timedelta(hours=1),
+            site = Site.objects.get_current(),
+        )
+        children = list(Comment.objects.get(pk=c1.pk).get_children())
+        self.assertEqual(children, [earlier, later])
+
+    def testTreeIdsStartAboveExistingTrees(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        Comment.objects.filter(pk=c4.pk).update(tree_id=100)
+        CommentTreeId.objects.all().delete()
+        CommentTreeId._seeded.discard('default')
+        c5 = Comment.objects.create(
+            content_type = c1.content_type,
+            object_pk = c1.object_pk,
+            comment = "Late to the party.",
+            site = Site.objects.get_current(),
+        )
+        self.assertTrue('default' in CommentTreeId._seeded)
+        self.assertTrue(c5.tree_id > 100)
+
 class CommentManagerTests(CommentTestCase):
 
     def testInModeration(self):
@@ -50,9 +154,141 @@ class CommentManagerTests(CommentTestCase):
         self.assertEqual(article_comments, [c1, c3])
         self.assertEqual(author_comments, [c2])
 
+    def testForModelWithTextKeys(self):
+        book = Book.objects.get(pk="12.34")
+        c = Comment.objects.create(
+            content_type = CT(Book),
+            object_pk = "12.34",
+            comment = "Dewey approves.",
+            site = Site.objects.get_current(),
+        )
+        self.assertEqual(c.object_pk_int, None)
+        self.assertEqual(list(Comment.objects.for_model(book)), [c])
+
+    def testCommentsWithoutIntegerKeys(self):
+        # Integer lookups are off by default, so comments saved before
+        # object_pk_int was filled in are still found.
+        c1, c2, c3, c4 = self.createSomeComments()
+        Comment.objects.update(object_pk_int=None)
+        self.assertEqual(object_pk_lookup(Comment, "1"), {'object_pk': "1"})
+        self.assertEqual(list(Comment.objects.for_model(Author.objects.get(pk=1))), [c2])
+
     def testPrefetchRelated(self):
         c1, c2, c3, c4 = self.createSomeComments()
         # one for comments, one for Articles, one for Author
         with self.assertNumQueries(3):
             qs = Comment.objects.prefetch_related('content_object')
             [c.content_object for c in qs]
+
+    def testPrefetchContentObjects(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        Book.objects.create(dewey_decimal="98.76")
+        Comment.objects.create(
+            content_type = CT(Book),
+            object_pk = "98.76",
+            comment = "Dewey approves.",
+            site = Site.objects.get_current(),
+        )
+        Author.objects.filter(pk=2).delete()
+        # One for comments, one for each of Article, Author and Book.
+        with self.assertNumQueries(4):
+            qs = Comment.objects.order_by('pk')
+            targets = [c.content_object for c in Comment.objects.prefetch_content_objects(qs)]
+        self.assertEqual(targets, [Article.objects.get(pk=1), Author.objects.get(pk=1),
+                                   Article.objects.get(pk=1), None,
+                                   Book.objects.get(pk="98.76")])
+
+class IntegerObjectKeyTests(CommentTestCase):
+
+    def setUp(self):
+        super(IntegerObjectKeyTests, self).setUp()
+        self.old_integer_pks = managers.COMMENTS_INTEGER_OBJECT_PKS
+        managers.COMMENTS_INTEGER_OBJECT_PKS = True
+
+    def tearDown(self):
+        managers.COMMENTS_INTEGER_OBJECT_PKS = self.old_integer_pks
+        super(IntegerObjectKeyTests, self).tearDown()
+
+    def testIntegerObjectKeys(self):
+        self.assertEqual(integer_pk(42), 42)
+        self.assertEqual(integer_pk("-3"), -3)
+        for object_pk in ("007", "+7", "12.34", "abc", "", str(2 ** 63)):
+            self.assertEqual(integer_pk(object_pk), None)
+
+        c1, c2, c3, c4 = self.createSomeComments()
+        self.assertEqual(Comment.objects.get(pk=c1.pk).object_pk_int, 1)
+        self.assertEqual(object_pk_lookup(Comment, "1"), {'object_pk_int': 1})
+        self.assertEqual(object_pk_lookup(Comment, "12.34"), {'object_pk': "12.34"})
+
+    def testFillObjectKeys(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        Comment.objects.update(object_pk_int=None)
+        self.assertEqual(list(Comment.objects.for_model(Author.objects.get(pk=1))), [])
+        self.assertEqual(fill_object_pk_ints(Comment, chunk_size=3), 4)
+        self.assertEqual(list(Comment.objects.for_model(Author.objects.get(pk=1))), [c2])
+
+
+class CommentFlagCounterTests(CommentTestCase):
+
+    def testFlagCounters(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        user = User.objects.get(username="normaluser")
+        flag = CommentFlag.objects.create(comment=c1, user=user, flag=CommentFlag.SUGGEST_REMOVAL)
+        CommentFlag.objects.create(comment=c1, user=user, flag="custom flag")
+
+        # The cached comment instance is kept in sync.
+        self.assertEqual((c1.flag_count, c1.suggest_removal_count), (2, 1))
+
+        # Saving the comment doesn't lose the counters.
+        c1.save()
+        c1 = Comment.objects.get(pk=c1.pk)
+        self.assertEqual((c1.flag_count, c1.suggest_removal_count), (2, 1))
+
+        # Nor does saving an instance loaded before the flags were added.
+        stale = Comment.objects.get(pk=c1.pk)
+        CommentFlag.objects.create(comment=c1, user=c4.user, flag=CommentFlag.MODERATOR_APPROVAL)
+        stale.is_public = False
+        stale.save()
+        c1 = Comment.objects.get(pk=c1.pk)
+        self.assertEqual((c1.flag_count, c1.moderator_approval_count, c1.is_public), (3, 1, False))
+        CommentFlag.objects.filter(flag=CommentFlag.MODERATOR_APPROVAL).get().delete()
+
+        # Saving the flag again doesn't count it twice.
+        flag.save()
+        flag.delete()
+        c1 = Comment.objects.get(pk=c1.pk)
+        self.assertEqual((c1.flag_count, c1.suggest_removal_count), (1, 0))
+
+    def testSaveKeepsDefaultPath(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        saved = []
+        def receiver(sender, update_fields, **kwargs):
+            saved.append(update_fields)
+        models.signals.post_save.connect(receiver, sender=Comment)
+        try:
+            c1.save()
+        finally:
+            models.signals.post_save.disconnect(receiver, sender=Comment)
+        self.assertEqual(saved, [None])
+
+        # A comment with a primary key but no row is inserted.
+        Comment.objects.filter(pk=c2.pk).delete()
+        c2.save()
+        self.assertTrue(Comment.objects.filter(pk=c2.pk).exists())
+
+    def testRecountFlagCounters(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        user = User.objects.get(username="normaluser")
+        CommentFlag.objects.create(comment=c1, user=user, flag=CommentFlag.SUGGEST_REMOVAL)
+        CommentFlag.objects.create(comment=c1, user=c4.user, flag=CommentFlag.SUGGEST_REMOVAL)
+        CommentFlag.objects.create(comment=c2, user=user, flag="custom flag")
+        Comment.objects.update(flag_count=0, suggest_removal_count=0)
+
+        # Flags counted before the recount don't take the counters below 0.
+        CommentFlag.objects.filter(comment=c2).get().delete()
+        self.assertEqual(Comment.objects.get(pk=c2.pk).flag_count, 0)
+
+        self.assertEqual(recount_flag_counters(chunk_size=2), 1)
+        c1 = Comment.objects.get(pk=c1.pk)
+        self.assertEqual((c1.flag_count, c1.suggest_removal_count), (2, 2))
+        self.assertEqual(recount_flag_counters(), 0)
@@ -29,6 +29,7 @@ class FlagViewTests(CommentTestCase):
         self.assertEqual(response["Location"], "http://testserver/flagged/?c=%d" % pk)
         c = Comment.objects.get(pk=pk)
         self.assertEqual(c.flags.filter(flag=CommentFlag.SUGGEST_REMOVAL).count(), 1)
+        self.assertEqual(c.suggest_removal_count, 1)
         return c
 
     def testFlagPostNext(self):
@@ -61,6 +62,7 @@ class FlagViewTests(CommentTestCase):
         self.client.post("/flag/%d/" % c.pk)
         self.client.post("/flag/%d/" % c.pk)
         self.assertEqual(c.flags.filter(flag=CommentFlag.SUGGEST_REMOVAL).count(), 1)
+        self.assertEqual(Comment.objects.get(pk=c.pk).suggest_removal_count, 1)
 
     def testFlagAnon(self):
         """GET/POST the flag view while not logged in: redirect to log in."""
@@ -127,6 +129,7 @@ class DeleteViewTests(CommentTestCase):
         c = Comment.objects.get(pk=pk)
         self.assertTrue(c.is_removed)
         self.assertEqual(c.flags.filter(flag=CommentFlag.MODERATOR_DELETION, user__username="normaluser").count(), 1)
+        self.assertEqual((c.flag_count, c.moderator_deletion_count), (1, 1))
 
     def testDeletePostNext(self):
         """
@@ -317,3 +320,59 @@ class AdminActionsTests(CommentTestCase):
             #Test removing
             self.performActionAndCheckMessage('remove_comments', one_comment, '1 comment was successfully removed.')
             self.performActionAndCheckMessage('remove_comments', many_comments, '3 comments were successfully removed.')
+
+class ModerationQueueTests(CommentTestCase):
+
+    def createQueue(self):
+        c1, c2, c3, c4 = self.createSomeComments()
+        for c in (c1, c2, c3):
+            c.is_public = False
+            c.save()
+        for user in User.objects.all():
+            CommentFlag.objects.create(comment=c3, user=user, flag=CommentFlag.SUGGEST_REMOVAL)
+        return c1, c2, c3
+
+    def testQueuePermissions(self):
+        """The moderation queue should only be accessible to 'moderators'"""
+        self.client.login(username="normaluser", password="normaluser")
+        response = self.client.get("/moderation/")
+        self.assertEqual(response["Location"], "http://testserver/accounts/login/?next=/moderation/")
+
+        makeModerator("normaluser")
+        response = self.client.get("/moderation/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "comments/moderation_queue.html")
+
+    def testQueueOrdering(self):
+        """The most flagged comments come first, then the oldest"""
+        c1, c2, c3 = self.createQueue()
+        self.assertEqual(list(Comment.objects.moderation_queue()), [c3, c1, c2])
+        self.assertEqual(Comment.objects.moderation_queue()[0].suggest_removal_count, 2)
+
+    def testQueueKeysetPaging(self):
+        c1, c2, c3 = self.createQueue()
+        self.assertEqual(list(Comment.objects.moderation_queue(after=c3.pk)), [c1, c2])
+        self.assertEqual(list(Comment.objects.moderation_queue(after=c1.pk)), [c2])
+        self.assertEqual(list(Comment.objects.moderation_queue(after=c2.pk)), [])
+
+    def testQueueView(self):
+        c1, c2, c3 = self.createQueue()
+        makeModerator("normaluser")
+        self.client.login(username="normaluser", password="normaluser")
+
+        from comments.views import moderation
+        per_page = moderation.COMMENTS_MODERATION_QUEUE_PER_PAGE
+        moderation.COMMENTS_MODERATION_QUEUE_PER_PAGE = 2
+        try:
+            response = self.client.get("/moderation/")
+            self.assertEqual(response.context["comment_list"], [c3, c1])
+            self.assertEqual(response.context["next_after"], c1.pk)
+
+            response = self.client.get("/moderation/", {"after": c1.pk})
+            self.assertEqual(response.context["comment_list"], [c2])
+            self.assertEqual(response.context["next_after"], None)
+        finally:
+            moderation.COMMENTS_MODERATION_QUEUE_PER_PAGE = per_page
+
+        response = self.client.get("/moderation/", {"after": "bogus"})
+        self.assertEqual(response.status_code, 404)
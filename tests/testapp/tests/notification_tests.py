@@ -0,0 +1,143 @@
+from __future__ import absolute_import
+
+import datetime
+
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from comments.models import Comment, CommentNotification
+from comments.moderation import CommentModerator, moderator
+from comments.notifications import (queue_digest_notifications,
+    send_queued_notifications, COMMENTS_EMAIL_DIGEST_INTERVAL)
+
+from . import CommentTestCase, CT
+from ..models import Entry
+
+
+class EntryQueueModerator(CommentModerator):
+    email_notification = True
+    queue_email = True
+
+class EntryDigestModerator(CommentModerator):
+    email_notification = True
+    email_digest = True
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise IOError("Mail server is down")
+
+class NotificationTestCase(CommentTestCase):
+    fixtures = ["comment_utils.xml"]
+
+    def createComment(self):
+        return Comment.objects.create(
+            content_type = CT(Entry),
+            object_pk = "1",
+            user_name = "Joe Somebody",
+            user_email = "jsomebody@example.com",
+            comment = "First!",
+            site = Site.objects.get_current(),
+        )
+
+@override_settings(MANAGERS=(("Manager", "manager@example.com"),))
+class CommentNotificationTests(NotificationTestCase):
+
+    def queueNotification(self):
+        entry = Entry.objects.get(pk=1)
+        EntryQueueModerator(Entry).email(self.createComment(), entry, None)
+
+    def testQueueEmail(self):
+        self.queueNotification()
+        self.assertEqual(len(mail.outbox), 0)
+        notification = CommentNotification.objects.pending().get()
+        self.assertEqual(notification.recipient_list, ["manager@example.com"])
+        self.assertEqual(notification.comment.comment, "First!")
+
+    def testSendQueuedNotifications(self):
+        for i in range(3):
+            self.queueNotification()
+        call_command("send_comment_notifications", batch_size=2, verbosity=0)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ["manager@example.com"])
+        self.assertEqual(CommentNotification.objects.pending().count(), 0)
+
+        # Sent notifications aren't delivered twice.
+        call_command("send_comment_notifications", verbosity=0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def testFailedNotificationsAreRetried(self):
+        self.queueNotification()
+        sent, failed = send_queued_notifications(connection=FailingEmailBackend())
+        self.assertEqual((sent, failed), (0, 1))
+
+        notification = CommentNotification.objects.get()
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.sent_date, None)
+        self.assertEqual(notification.last_error, "Mail server is down")
+
+        # Notifications which used up their attempts are skipped.
+        self.assertEqual(send_queued_notifications(max_attempts=1), (0, 0))
+        self.assertEqual(send_queued_notifications(max_attempts=2), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def testConcurrentWorkersDontSendTwice(self):
+        for i in range(2):
+            self.queueNotification()
+        other_worker = []
+
+        class OtherWorkerBackend(EmailBackend):
+            # Another worker drains the outbox while the first notification
+            # is being sent.
+            def send_messages(backend, messages):
+                if not other_worker:
+                    other_worker.append(send_queued_notifications(connection=EmailBackend()))
+                return super(OtherWorkerBackend, backend).send_messages(messages)
+
+        self.assertEqual(send_queued_notifications(connection=OtherWorkerBackend()), (1, 0))
+        self.assertEqual(other_worker, [(1, 0)])
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(CommentNotification.objects.pending().count(), 0)
+
+
+@override_settings(MANAGERS=(("Manager", "manager@example.com"),
+                             ("Editor", "editor@example.com")))
+class CommentDigestTests(NotificationTestCase):
+
+    def setUp(self):
+        moderator.register(Entry, EntryDigestModerator)
+
+    def tearDown(self):
+        moderator.unregister(Entry)
+
+    def testNoEmailPerComment(self):
+        EntryDigestModerator(Entry).email(self.createComment(), Entry.objects.get(pk=1), None)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(CommentNotification.objects.count(), 0)
+
+    def testQueueDigest(self):
+        self.createComment()
+        self.createComment()
+        self.assertEqual(queue_digest_notifications(), 2)
+
+        self.assertEqual(send_queued_notifications(), (2, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         ["editor@example.com", "manager@example.com"])
+        self.assertTrue(mail.outbox[0].body.startswith("2 new comment(s)"))
+        self.assertTrue("On ABC:" in mail.outbox[0].body)
+
+    def testDigestInterval(self):
+        self.createComment()
+        self.assertEqual(queue_digest_notifications(), 2)
+
+        # The next digest isn't due yet.
+        self.createComment()
+        self.assertEqual(queue_digest_notifications(), 0)
+
+        later = timezone.now() + datetime.timedelta(seconds=COMMENTS_EMAIL_DIGEST_INTERVAL)
+        self.assertEqual(queue_digest_notifications(now=later), 2)
+        digest = CommentNotification.objects.filter(digest_until=later)[0]
+        self.assertTrue(digest.message.startswith("1 new comment(s)"))
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+
+import logging
+import random
+import threading
+import time
+
+from django.contrib.sites.models import Site
+from django.db import connection, connections, DatabaseError, IntegrityError
+from django.test import TransactionTestCase
+
+from comments.models import Comment
+from comments.posting import save_comment
+
+from . import CommentTestCase, CT
+from ..models import Article
+
+
+logger = logging.getLogger('comments.tests')
+
+
+class TreeIntegrityMixin(object):
+
+    def assertTreeIntact(self, tree_id):
+        nodes = dict((c.pk, c) for c in Comment.objects.filter(tree_id=tree_id))
+        bounds = sorted([c.lft for c in nodes.values()] + [c.rght for c in nodes.values()])
+        self.assertEqual(bounds, list(range(1, 2 * len(nodes) + 1)))
+        for c in nodes.values():
+            if c.parent_id is None:
+                self.assertEqual((c.lft, c.level), (1, 0))
+            else:
+                parent = nodes[c.parent_id]
+                self.assertTrue(parent.lft < c.lft < c.rght < parent.rght)
+                self.assertEqual(c.level, parent.level + 1)
+
+    def reply(self, parent, text="Reply"):
+        return Comment(
+            content_type = parent.content_type,
+            object_pk = parent.object_pk,
+            parent = parent,
+            comment = text,
+            site = Site.objects.get_current(),
+        )
+
+
+class SaveCommentTests(TreeIntegrityMixin, CommentTestCase):
+
+    def testSaveRootComment(self):
+        c = save_comment(Comment(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = "First!",
+            site = Site.objects.get_current(),
+        ))
+        self.assertNotEqual(c.pk, None)
+        self.assertTreeIntact(c.tree_id)
+
+    def testReplyToStaleParent(self):
+        c1 = self.createSomeComments()[0]
+        stale = Comment.objects.get(pk=c1.pk)
+        save_comment(self.reply(Comment.objects.get(pk=c1.pk), "Quick"))
+        # The parent's rght is out of date by now; saving through it must not
+        # corrupt the thread.
+        reply = save_comment(self.reply(stale, "Slow"))
+        self.assertEqual((reply.lft, reply.rght), (4, 5))
+        self.assertTreeIntact(c1.tree_id)
+
+    def failingSave(self, comment, *errors):
+        """
+        Make ``comment.save`` raise ``errors`` on its first calls, and
+        return the list of calls made.
+        """
+        calls = []
+        def save(*args, **kwargs):
+            calls.append(kwargs)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return Comment.save(comment, *args, **kwargs)
+        comment.save = save
+        return calls
+
+    def testRetryAbortedSave(self):
+        c1 = self.createSomeComments()[0]
+        reply = self.reply(c1)
+        calls = self.failingSave(reply, DatabaseError("database is locked"))
+        save_comment(reply)
+        self.assertEqual(len(calls), 2)
+        self.assertNotEqual(reply.pk, None)
+        self.assertTreeIntact(c1.tree_id)
+
+    def testRetriesAreLimited(self):
+        c1 = self.createSomeComments()[0]
+        reply = self.reply(c1)
+        calls = self.failingSave(reply, *[DatabaseError("deadlock detected")] * 3)
+        self.assertRaises(DatabaseError, save_comment, reply, retries=2)
+        self.assertEqual(len(calls), 3)
+
+    def testOtherErrorsAreNotRetried(self):
+        c1 = self.createSomeComments()[0]
+        for error in (IntegrityError("NOT NULL constraint failed"), DatabaseError("no such column")):
+            reply = self.reply(c1)
+            calls = self.failingSave(reply, error)
+            self.assertRaises(DatabaseError, save_comment, reply)
+            self.assertEqual(len(calls), 1)
+
+
+class ConcurrentPostingTests(TreeIntegrityMixin, TransactionTestCase):
+    fixtures = ["comment_tests"]
+    urls = 'testapp.urls_default'
+
+    threads = 8
+    replies_per_thread = 25
+    # SQLite turns a writer away, as "database is locked", when another one
+    # commits while it reads; posting retries until it gets its turn.
+    retries = 20
+
+    def testConcurrentReplies(self):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            self.skipTest("Threads don't share an in-memory SQLite database.")
+        roots = [save_comment(Comment(
+            content_type = CT(Article),
+            object_pk = "1",
+            comment = "Thread %d" % i,
+            site = Site.objects.get_current(),
+        )) for i in range(2)]
+        errors = []
+
+        def post(seed):
+            rand = random.Random(seed)
+            try:
+                for i in range(self.replies_per_thread):
+                    root = rand.choice(roots)
+                    parent = rand.choice(list(Comment.objects.filter(tree_id=root.tree_id)))
+                    save_comment(self.reply(parent, "Reply %d.%d" % (seed, i)), self.retries)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for connection in connections.all():
+                    connection.close()
+
+        workers = [threading.Thread(target=post, args=(n,)) for n in range(self.threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+
+        self.assertEqual(errors, [])
+        total = self.threads * self.replies_per_thread
+        self.assertEqual(Comment.objects.filter(parent__isnull=False).count(), total)
+        for root in roots:
+            self.assertTreeIntact(root.tree_id)
+        logger.info("%d concurrent replies in %.2fs (%.0f/s)", total, elapsed, total / elapsed)
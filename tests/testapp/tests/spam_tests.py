@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+
+from comments import spam
+from comments.models import Comment
+from comments.moderation import CommentModerator
+
+from . import CommentTestCase, CT
+from ..models import Entry
+
+
+HAM = ["Great article, thanks for writing it",
+       "I disagree with the author on the second point",
+       "Nice photo of the harbour"]
+SPAM = ["Buy cheap pills now",
+        "Cheap viagra online, buy today",
+        "Casino bonus, buy now"]
+
+class EntrySpamModerator(CommentModerator):
+    spam_threshold = 0.9
+
+class SpamClassifierTests(CommentTestCase):
+    fixtures = ["comment_utils.xml"]
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.model_path = os.path.join(self.tempdir, "spam.json")
+        self.saved_model, spam.COMMENTS_SPAM_MODEL = spam.COMMENTS_SPAM_MODEL, self.model_path
+
+    def tearDown(self):
+        spam.COMMENTS_SPAM_MODEL = self.saved_model
+        shutil.rmtree(self.tempdir)
+
+    def createComment(self, text, **kwargs):
+        return Comment.objects.create(
+            content_type = CT(Entry),
+            object_pk = "1",
+            user_name = "Joe Somebody",
+            comment = text,
+            site = Site.objects.get_current(),
+            **kwargs
+        )
+
+    def trainClassifier(self):
+        classifier = spam.NaiveBayesSpamClassifier()
+        classifier.train(HAM, False)
+        classifier.train(SPAM, True)
+        return classifier
+
+    def testScore(self):
+        classifier = self.trainClassifier()
+        spam_score, ham_score = classifier.score_many(["buy cheap pills", "thanks for the article"])
+        self.assertTrue(spam_score > 0.9)
+        self.assertTrue(ham_score < 0.5)
+        self.assertEqual(classifier.score("buy cheap pills"), spam_score)
+
+    def testSaveAndLoad(self):
+        self.assertEqual(spam.get_classifier(), None)
+        self.trainClassifier().save(self.model_path)
+        classifier = spam.get_classifier()
+        self.assertTrue(classifier.score("buy cheap pills") > 0.9)
+        self.assertTrue(spam.get_classifier() is classifier)
+
+    def testModeratorSpam(self):
+        moderation_class = EntrySpamModerator(Entry)
+        entry = Entry.objects.get(pk=1)
+        comment = Comment(comment="Buy cheap pills", user_name="", title="", user_url="")
+        # No model has been trained yet.
+        self.assertFalse(moderation_class.spam(comment, entry, None))
+
+        self.trainClassifier().save(self.model_path)
+        self.assertTrue(moderation_class.spam(comment, entry, None))
+        self.assertTrue(comment.spam_score > 0.9)
+        comment.comment = "Thanks for the article"
+        self.assertFalse(moderation_class.spam(comment, entry, None))
+
+    def testTrainAndRescoreCommands(self):
+        for text in HAM:
+            self.createComment(text)
+        for text in SPAM:
+            self.createComment(text, is_removed=True)
+        queued = self.createComment("Buy cheap pills", is_public=False)
+
+        call_command("train_spam_classifier", verbosity=0)
+        self.assertEqual(spam.get_classifier().doc_counts, {"ham": 3, "spam": 3})
+
+        call_command("rescore_comments", verbosity=0)
+        self.assertTrue(Comment.objects.get(pk=queued.pk).spam_score > 0.9)
+        self.assertEqual(Comment.objects.filter(spam_score__isnull=False).count(), 1)
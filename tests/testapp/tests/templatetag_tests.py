@@ -3,6 +3,7 @@ from __future__ import absolute_import
 from django.contrib.contenttypes.models import ContentType
 from django.template import Template, Context, Library, libraries
 
+from comments import archive
 from comments.forms import CommentForm
 from comments.models import Comment
 
@@ -157,6 +158,8 @@ class CommentTemplateTagTests(CommentTestCase):
         """
 
         self.createSomeComments()
+        # Whether the article's comments are archived is cached from here on.
+        archive.is_archived(ContentType.objects.get_for_model(Article), 1)
 
         # {% render_comment_list %} -----------------
 
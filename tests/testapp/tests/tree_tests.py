@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
+
+from comments.models import Comment
+from comments.trees import check_trees
+
+from . import CommentTestCase
+from .posting_tests import TreeIntegrityMixin
+
+
+class CheckTreesTests(TreeIntegrityMixin, CommentTestCase):
+
+    def setUp(self):
+        super(CheckTreesTests, self).setUp()
+        self.c1, self.c2, self.c3, self.c4 = self.createSomeComments()
+        for text in ("One", "Two"):
+            self.reply = Comment.objects.create(
+                content_type = self.c1.content_type,
+                object_pk = self.c1.object_pk,
+                parent = Comment.objects.get(pk=self.c1.pk),
+                comment = text,
+                site = Site.objects.get_current(),
+            )
+        self.tree_ids = list(Comment.objects.values_list('tree_id', flat=True).distinct())
+
+    def testIntactTrees(self):
+        self.assertEqual(check_trees(Comment, self.tree_ids), ([], []))
+
+    def testRepairBrokenTree(self):
+        Comment.objects.filter(pk=self.reply.pk).update(lft=2, rght=3)
+        self.assertEqual(check_trees(Comment, self.tree_ids), ([self.c1.tree_id], []))
+        self.assertEqual(check_trees(Comment, self.tree_ids, repair=True),
+                         ([self.c1.tree_id], [self.c1.tree_id]))
+        self.assertTreeIntact(self.c1.tree_id)
+        self.assertEqual(check_trees(Comment, self.tree_ids), ([], []))
+
+    def testWrongLevel(self):
+        Comment.objects.filter(pk=self.reply.pk).update(level=2)
+        self.assertEqual(check_trees(Comment, self.tree_ids, repair=True),
+                         ([self.c1.tree_id], [self.c1.tree_id]))
+        self.assertEqual(Comment.objects.get(pk=self.reply.pk).level, 1)
+
+    def testCommand(self):
+        Comment.objects.filter(pk=self.reply.pk).update(rght=10)
+        out = StringIO()
+        call_command('check_comment_trees', repair=True, chunk_size=2, stdout=out)
+        self.assertTrue("Checked 4 thread(s): 1 broken, 1 repaired." in out.getvalue())
+        self.assertTreeIntact(self.c1.tree_id)
+
+    def testCommandUnrepairable(self):
+        # Two roots sharing a tree id.
+        Comment.objects.filter(pk=self.c2.pk).update(tree_id=self.c1.tree_id)
+        self.assertRaises(CommandError, call_command, 'check_comment_trees',
+                          repair=True, verbosity=0)
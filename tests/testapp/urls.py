@@ -2,7 +2,7 @@ from __future__ import absolute_import
 
 from django.conf.urls import patterns, url
 
-from comments.feeds import LatestCommentFeed
+from comments.feeds import LatestCommentFeed, ObjectCommentFeed, UserCommentFeed
 
 from custom_comments import views
 
@@ -21,4 +21,6 @@ urlpatterns = patterns('',
 
 urlpatterns += patterns('',
     (r'^rss/comments/$', LatestCommentFeed()),
+    (r'^rss/comments/(\w+\.\w+)/([^/]+)/$', ObjectCommentFeed()),
+    (r'^rss/comments/user/(\d+)/$', UserCommentFeed()),
 )